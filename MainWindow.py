@@ -5,86 +5,18 @@ import json
 import subprocess
 import shutil
 from threading import Thread
-from chardet.universaldetector import UniversalDetector
 
 from PyQt5 import QtWidgets, QtCore, QtGui, QtMultimedia, QtMultimediaWidgets
 from form import Ui_Mainwindow
-from utils import split_audio_by_pauses, is_path_to_txt, is_path_to_audio, speech_recognize, \
-                  StringComparison, text_difference, log, safe_audiosegment
+from utils import is_path_to_txt, log, safe_audiosegment
+from processing import ProcessingThread
+from batch import Batchwindow
 from settings import Settingswindow
-
-class ProcessingThread(QtCore.QThread):
-    finish_signal = QtCore.pyqtSignal(object, object, object) # ToDo: Refactoring
-
-    def __init__(self, parent=None):
-        QtCore.QThread.__init__(self, parent)
-
-        self.audioPath:str
-        self.outdirPath:str
-        self.txtPath:str
-        self.min_sec:int
-        self.max_sec:int
-        self.min_accuracy:int
-        self.sampling_rate:int
-        self.min_silence_len:int
-        self.keep_silence:int
-        self.silence_thresh:int
-        self.begin:int = -1
-        self.end:int = -1
-
-    def run(self):
-        filename = self.audioPath
-        outdir = self.outdirPath
-        txt = self.txtPath
-
-        if not os.path.isdir(outdir):
-            os.mkdir(outdir)
-
-        # split audio
-        split_audio_by_pauses(filename, outdir, self.min_sec, self.max_sec,
-                              min_silence_len=self.min_silence_len, silence_thresh=self.silence_thresh,
-                              keep_silence=self.keep_silence, framerate=self.sampling_rate,
-                              begin=self.begin, end=self.end)
-
-        # speech recognize
-        detector = UniversalDetector()
-        with open(txt, 'rb') as fh:
-            for line in fh:
-                detector.feed(line)
-                if detector.done:
-                    break
-            detector.close()
-            
-        with open(txt, 'r', encoding=detector.result['encoding']) as text_file:
-            original_text = text_file.read()
-
-        sc = StringComparison(original_text)
-
-        for sample in sorted(os.listdir(outdir)):
-            sample_name = sample.rsplit('.', 1)[0]
-            if is_path_to_audio(sample):
-                if os.path.isfile(f'{outdir}/{sample_name}.txt'):
-                    continue
-                result = speech_recognize(f'{outdir}/{sample}')
-                if len(result) > 0:
-                    result = ' '.join(result.splitlines())
-                    _, rate, output = sc.find(result)
-                    if self.min_accuracy > rate:
-                        os.remove(f'{outdir}/{sample}')
-                        continue
-                    
-                    with open(f'{outdir}/{sample_name}.txt', 'w', encoding='utf-8') as text:
-                        text.write(output)
-                    
-                    if not os.path.isdir(f'{outdir}/diff'):
-                        os.mkdir(f'{outdir}/diff')
-
-                    with open(f'{outdir}/diff/{sample_name}.txt', 'w', encoding='utf-8') as text:
-                        text.write('\n'.join(text_difference(output, result)))
-
-
-        self.finish_signal.emit(True, None, None) 
-
+from waveform import WaveformWidget, peaks_cache_path
+from chunk_store import ChunkStore
+from checkpoint import Checkpoint
+from speakers import SpeakerRegistry
+from clustering import SpeakerClusters
 
 class Mainwindow(QtWidgets.QMainWindow):
     def __init__(self):
@@ -109,6 +41,12 @@ class Mainwindow(QtWidgets.QMainWindow):
 
         self.diffIdx = None
         self.diffFiles = list()
+        self.chunkStore = None
+        self.playerBuffer = None
+        self.speakers = None
+        self.clusters = None
+        self.speakerName = ''
+        self.accuracies = {}
 
         self.player = QtMultimedia.QMediaPlayer()
         self.loadParams()
@@ -124,6 +62,10 @@ class Mainwindow(QtWidgets.QMainWindow):
 
         self.ui.paramsBt.clicked.connect(self.paramsClicked)
 
+        self.batchBt = QtWidgets.QPushButton("Batch queue", self.ui.page)
+        self.ui.horizontalLayout_5.insertWidget(1, self.batchBt)
+        self.batchBt.clicked.connect(self.batchClicked)
+
         self.ui.audioBt.clicked.connect(self.audioDialog)
         self.ui.txtBt.clicked.connect(self.txtDialog)
         self.ui.outdirBt.clicked.connect(self.outdirDialog)
@@ -145,9 +87,15 @@ class Mainwindow(QtWidgets.QMainWindow):
         self.ui.slider.sliderMoved.connect(self.changeAudioValue)
         self.ui.playBt.clicked.connect(self.playClicked)
         self.ui.stopBt.clicked.connect(self.stopClicked)
+
+        self.waveform = WaveformWidget(self.ui.page_2)
+        self.ui.gridLayout_6.addWidget(self.waveform, 3, 0, 1, 1)
+        self.waveform.trim_signal.connect(self.trimChanged)
+        self.waveform.seek_signal.connect(self.waveformSeek)
         
         self.thread = ProcessingThread(self)
         self.thread.finish_signal.connect(self.stopProcessing)
+        self.thread.progress_signal.connect(self.updateProgress)
 
         # speakers
         self.ui.addSpeakerBt.clicked.connect(self.speakerAddClicked)
@@ -178,6 +126,10 @@ class Mainwindow(QtWidgets.QMainWindow):
         self.widget.show()
         self.loadParams()
 
+    def batchClicked(self):
+        self.batchWidget = Batchwindow()
+        self.batchWidget.show()
+
     def audioDialog(self):
         default_dir = self.params.get('default_audio_dir', '.')
         if default_dir != '.' and not os.path.isdir(default_dir):
@@ -195,7 +147,7 @@ class Mainwindow(QtWidgets.QMainWindow):
         default_dir = self.params.get('default_txt_dir', '.')
         if default_dir != '.' and not os.path.isdir(default_dir):
             default_dir = '.'
-        fname = QtWidgets.QFileDialog.getOpenFileName(self, 'Select txt', default_dir, "Txt (*.txt *.lab *.Textgrid)")[0]
+        fname = QtWidgets.QFileDialog.getOpenFileName(self, 'Select txt', default_dir, "Txt (*.txt *.lab *.TextGrid *.srt *.vtt)")[0]
         if fname != '':
             self.ui.txtCheck.setChecked(True)
             self.ui.txtLabel.setText(fname)
@@ -221,6 +173,10 @@ class Mainwindow(QtWidgets.QMainWindow):
             json.dump(self.params, params_json)
 
     def processBtClicked(self):
+        if self.thread.isRunning():
+            self.thread.requestInterruption()
+            self.statusText = "Cancelling after the current chunk... "
+            return
         if self.ui.audioCheck.isChecked() and self.ui.txtCheck.isChecked() and self.ui.outdirCheck.isChecked():
             if not (os.path.isfile(self.ui.audioLabel.text()) and os.path.isfile(self.ui.txtLabel.text()) and os.path.isdir(self.ui.outdirLabel.text())):
                 return
@@ -234,24 +190,29 @@ class Mainwindow(QtWidgets.QMainWindow):
             self.thread.audioPath = self.ui.audioLabel.text()
             self.thread.outdirPath = self.ui.outdirLabel.text()
             self.thread.txtPath = self.ui.txtLabel.text()
-            self.thread.min_sec = self.params['min_sample_len sec']
-            self.thread.max_sec = self.params['max_sample_len sec']
-            self.thread.min_accuracy = self.params['min_accuracy %']
-            self.thread.sampling_rate = self.params['sampling_rate']
-            self.thread.min_silence_len = self.params['min_silence_len ms']
-            self.thread.keep_silence = self.params['keep_silence ms']
-            self.thread.silence_thresh = self.params['silence_threshold db']
+            self.thread.setParams(self.params)
             if self.ui.customTimeCB.isChecked():
                 t1 = self.ui.beginTimeEdit_2.time()
                 t2 = self.ui.endTimeEdit_2.time()
-                self.thread.begin =  t1.second() + t1.minute()*60
-                self.thread.end = t2.second() + t2.minute()*60
+                self.thread.begin = t1.msecsSinceStartOfDay() / 1000
+                self.thread.end = t2.msecsSinceStartOfDay() / 1000
 
+            self.ui.processBt.setText("Cancel")
             self.thread.start()
 
-    def stopProcessing(self, one, two, three):
-        self.statusText = "Complete!"
+    def stopProcessing(self, completed, summary, error):
+        if error is not None:
+            self.statusText = f"Failed: {error}"
+        else:
+            self.statusText = f"Complete! {summary}" if completed else f"Cancelled. {summary}"
         self.timerFlag = False
+        self.ui.processBt.setText("Preprocess")
+
+    def updateProgress(self, stage, done, total, rate, eta):
+        status = f"{stage}: {done}/{total}, {rate:.2f}/sec"
+        if eta >= 0:
+            status += f", ETA {int(eta)} sec"
+        self.statusText = status + ","
 
     def updateStatus(self):
         if self.timerFlag:
@@ -269,6 +230,8 @@ class Mainwindow(QtWidgets.QMainWindow):
 
     def onFixDiffClicked(self):
         self.ui.stackedWidget.setCurrentIndex(1)
+        if os.path.isdir(self.ui.outdirLabel.text()):
+            self.loadSpeakers(self.ui.outdirLabel.text())
 
     def loadAudio(self):
         url = QtCore.QUrl.fromLocalFile('D:/Projects/Implementation/SimpleDataset/outdir/Рыбья кровь 1_01_00005.wav')
@@ -294,6 +257,15 @@ class Mainwindow(QtWidgets.QMainWindow):
             self.player.pause()
 
         self.ui.slider.setSliderPosition(self.player.position())
+        self.waveform.setTrim(self.leftEdge, self.rightEdge)
+        self.waveform.setPosition(self.player.position())
+
+    def trimChanged(self, leftEdge, rightEdge):
+        self.ui.beginTimeEdit.setTime(QtCore.QTime(0, 0).addMSecs(leftEdge))
+        self.ui.endTimeEdit.setTime(QtCore.QTime(0, 0).addMSecs(rightEdge))
+
+    def waveformSeek(self, position):
+        self.player.setPosition(position)
 
     def changeAudioValue(self):
         self.ui.slider.setMaximum(self.player.duration())
@@ -309,23 +281,23 @@ class Mainwindow(QtWidgets.QMainWindow):
             f.write(self.ui.currentTE.toPlainText())
 
         os.remove(f'{outdir}/diff/{diff_file}')
-        if not os.path.isdir(f'{outdir}/correct'):
-            os.mkdir(f'{outdir}/correct')
-
-        speaker_name = self.ui.currentSpeaker.text().split(':', 1)[1]
-        if speaker_name not in ['', ' ']:
-            if not os.path.isdir(f'{outdir}/correct/{speaker_name}'):
-                os.mkdir(f'{outdir}/correct/{speaker_name}')
-            speaker_name += '/'
+        if self.speakers is None or self.speakers.correctDir != f'{outdir}/correct':
+            self.loadSpeakers(outdir)
+        folder = self.speakers.sample_dir(self.speakerName)
 
         sample_name = diff_file.rsplit('.', 1)[0]
         
-        os.rename(f'{outdir}/{sample_name}.txt', f'{outdir}/correct/{speaker_name}{sample_name}.txt')
+        os.rename(f'{outdir}/{sample_name}.txt', f'{folder}/{sample_name}.txt')
         
-        audio = safe_audiosegment(f'{outdir}/{sample_name}.wav')[self.leftEdge: -self.rightEdge-5]
-        audio.export(f'{outdir}/correct/{speaker_name}{sample_name}.wav')
+        audio = self.loadSample(outdir, sample_name)[self.leftEdge: -self.rightEdge-5]
+        audio.export(f'{folder}/{sample_name}.wav', format='wav')
+        self.speakers.confirm(self.speakerName, sample_name, audio.duration_seconds,
+                              self.accuracies.get(f'{sample_name}.wav'))
+        if self.clusters is not None:
+            self.clusters.name(f'{sample_name}.wav', self.speakerName)
         del audio
-        os.remove(f'{outdir}/{sample_name}.wav')
+        self.removeSample(outdir, sample_name)
+        self.updateSpeakers()
 
         self.diffFiles.pop(self.diffIdx)
         if self.diffIdx == 0:
@@ -341,7 +313,7 @@ class Mainwindow(QtWidgets.QMainWindow):
         sample_name = diff_file.rsplit('.', 1)[0]
         os.remove(f'{outdir}/diff/{sample_name}.txt')
         os.remove(f'{outdir}/{sample_name}.txt')
-        os.remove(f'{outdir}/{sample_name}.wav')
+        self.removeSample(outdir, sample_name)
         
         self.diffFiles.pop(self.diffIdx)
         if self.diffIdx == 0:
@@ -350,6 +322,25 @@ class Mainwindow(QtWidgets.QMainWindow):
             self.diffIdx -= 1
         self.getNextDiffClicked()
 
+    def inChunkStore(self, outdir, sample_name):
+        return self.chunkStore is not None and f'{sample_name}.wav' in self.chunkStore \
+               and not os.path.isfile(f'{outdir}/{sample_name}.wav')
+
+    def loadSample(self, outdir, sample_name):
+        if self.inChunkStore(outdir, sample_name):
+            return self.chunkStore.segment(f'{sample_name}.wav')
+        # chunks are already at the processing rate, no resampling on confirm
+        return safe_audiosegment(f'{outdir}/{sample_name}.wav', -1)
+
+    def removeSample(self, outdir, sample_name):
+        if self.inChunkStore(outdir, sample_name):
+            self.chunkStore.remove(f'{sample_name}.wav')
+        else:
+            os.remove(f'{outdir}/{sample_name}.wav')
+        peaks = peaks_cache_path(f'{outdir}/peaks', f'{outdir}/{sample_name}.wav')
+        if os.path.isfile(peaks):
+            os.remove(peaks)
+
     def playClicked(self):
         if self.player.state() == QtMultimedia.QMediaPlayer.PlayingState:
             self.player.pause()
@@ -392,7 +383,9 @@ class Mainwindow(QtWidgets.QMainWindow):
         diff_file = os.path.basename(self.diffFiles[self.diffIdx])
         filename = diff_file.rsplit('.', 1)[0]
 
-        if not is_path_to_txt(diff_file) or not os.path.isfile(f'{outdir}/{filename}.wav'):
+        if not is_path_to_txt(diff_file):
+            return
+        if not (os.path.isfile(f'{outdir}/{filename}.wav') or self.inChunkStore(outdir, filename)):
             return
         
         with open(f'{outdir}/diff/{diff_file}', 'r', encoding='utf-8') as f:
@@ -436,12 +429,27 @@ class Mainwindow(QtWidgets.QMainWindow):
 
         with open(f'{outdir}/{diff_file}', 'r', encoding='utf-8') as f:
             self.ui.currentTE.setPlainText(f.read())
-
-        url = QtCore.QUrl.fromLocalFile(f'{outdir}/{filename}.wav')
-        content = QtMultimedia.QMediaContent(url)
-        self.player.setMedia(content)
+        if self.clusters is not None and self.clusters.label(f'{filename}.wav') is not None:
+            # an unnamed cluster is only shown: a placeholder must not become a speaker folder,
+            # and the speaker of another cluster must not name this one on confirm
+            named = self.clusters.speaker(f'{filename}.wav')
+            self.setSpeaker(named if named is not None else '', self.clusters.label(f'{filename}.wav'))
+
+        if self.inChunkStore(outdir, filename):
+            buffer = QtCore.QBuffer()
+            buffer.setData(self.chunkStore.wav_bytes(f'{filename}.wav'))
+            buffer.open(QtCore.QIODevice.ReadOnly)
+            self.player.setMedia(QtMultimedia.QMediaContent(), buffer)
+            self.playerBuffer = buffer
+        else:
+            url = QtCore.QUrl.fromLocalFile(f'{outdir}/{filename}.wav')
+            content = QtMultimedia.QMediaContent(url)
+            self.player.setMedia(content)
         self.player.stop()
         self.ui.slider.setSliderPosition(0)
+        self.ui.beginTimeEdit.setTime(QtCore.QTime(0, 0))
+        self.ui.endTimeEdit.setTime(QtCore.QTime(0, 0))
+        self.waveform.load(f'{outdir}/{filename}.wav', f'{outdir}/peaks', self.chunkStore)
 
     def backClicked(self):
         self.ui.stackedWidget.setCurrentIndex(0)
@@ -449,7 +457,12 @@ class Mainwindow(QtWidgets.QMainWindow):
     def refreshDiffs(self):
         self.ui.recognizedTE.clear()
         self.ui.currentTE.clear()
+        self.waveform.clear()
         self.diffIdx = None
+        outdir = self.ui.outdirLabel.text()
+        self.chunkStore = ChunkStore(outdir) if ChunkStore.exists(outdir) else None
+        self.clusters = SpeakerClusters(outdir) if SpeakerClusters.exists(outdir) else None
+        self.loadSpeakers(outdir)
 
         if not os.path.isdir(f'{self.ui.outdirLabel.text()}/diff'):
             return
@@ -463,15 +476,43 @@ class Mainwindow(QtWidgets.QMainWindow):
 
     # speakers
 
+    def loadSpeakers(self, outdir):
+        self.speakers = SpeakerRegistry(outdir)
+        if not os.path.isfile(self.speakers.path) and os.path.isdir(self.speakers.correctDir):
+            self.speakers.rebuild()
+        checkpoint = Checkpoint(outdir)
+        checkpoint.read()
+        self.accuracies = {name: event['rate'] for name, event in checkpoint.aligned.items()}
+        self.updateSpeakers()
+
+    def updateSpeakers(self):
+        self.ui.speakersList.clear()
+        for speaker in self.speakers.speakers():
+            item = QtWidgets.QListWidgetItem(speaker)
+            item.setToolTip(self.speakers.summary(speaker))
+            self.ui.speakersList.addItem(item)
+        self.setSpeaker(self.speakerName if self.speakerName in self.speakers.speakers() else '')
+
+    def setSpeaker(self, speaker, cluster=None):
+        self.speakerName = speaker
+        stats = f' ({self.speakers.summary(speaker)})' if speaker and self.speakers is not None else ''
+        voice = f'; voice: {cluster}' if cluster is not None else ''
+        self.ui.currentSpeaker.setText(f"Current speaker:{speaker}{stats}{voice}")
+
     def speakerClicked(self, item:QtWidgets.QListWidgetItem):
-        self.ui.currentSpeaker.setText(f"Current speaker:{item.text()}")
+        self.setSpeaker(item.text())
     
     def speakerAddClicked(self):
-        self.ui.speakersList.insertItem(0, self.ui.speakerNameTE.text())
+        speaker = self.ui.speakerNameTE.text().strip()
+        if speaker == '' or self.speakers is None:
+            return
+        self.speakers.add(speaker)
+        self.updateSpeakers()
 
     def speakerDeleteClicked(self):
         listItems=self.ui.speakersList.selectedItems()
-        if not listItems:
+        if not listItems or self.speakers is None:
             return
         for item in listItems:
-            self.ui.speakersList.takeItem(self.ui.speakersList.row(item))
+            self.speakers.remove(item.text())
+        self.updateSpeakers()
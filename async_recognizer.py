@@ -0,0 +1,169 @@
+import asyncio
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+import speech_recognition
+from speech_recognition.recognizers.google import ENDPOINT, create_request_builder, OutputParser
+
+from recognition import TransientRecognitionError, PermanentRecognitionError, transient_status
+from profiling import profiler
+
+
+class AsyncRecognizer:
+    '''
+        Google Speech API client with a pool of up to `connections` keep-alive
+        HTTP connections, driven by an asyncio loop in its own thread.
+        Calling it blocks the calling thread only, so every recognize worker
+        of the pipeline keeps a request in flight over an open connection
+        instead of connecting (and TLS handshaking) per chunk.
+        Requests and responses match speech_recognition.recognize_google
+    '''
+    def __init__(self, language: str = 'ru-RU', key: str = None, connections: int = 8,
+                 timeout: float = 30.0, endpoint: str = ENDPOINT):
+        self.builder = create_request_builder(endpoint=endpoint, key=key, language=language)
+        url = urlsplit(self.builder.build_url())
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if url.scheme == 'https' else None
+        self.target = f'{url.path}?{url.query}'
+        self.timeout = timeout
+        self.parser = OutputParser(show_all=False, with_confidence=False)
+        self.opened = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='recognizer-loop', daemon=True)
+        self.thread.start()
+        self.call(self.setup(connections))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def setup(self, connections: int) -> None:
+        self.slots = asyncio.Semaphore(max(connections, 1))
+        self.idle = []
+
+    def __call__(self, audio: speech_recognition.AudioData) -> str:
+        '''
+            Returns '' if there is no speech; network errors, timeouts,
+            malformed responses, 429 and 5xx raise TransientRecognitionError, other statuses
+            PermanentRecognitionError, as speech_recognize does
+        '''
+        with profiler.span('read chunk'):
+            body = self.builder.build_data(audio)
+        headers = self.builder.build_headers(audio)
+        with profiler.span('recognition'):
+            status, reason, text, connected = self.call(self.post(headers, body))
+        # counted here: the loop thread has no profiler bound
+        profiler.count('recognizer connections', connected)
+        if transient_status(status):
+            raise TransientRecognitionError(f'{status} {reason}')
+        if status != 200:
+            raise PermanentRecognitionError(f'recognition request failed: {status} {reason}')
+        try:
+            return self.parser.parse(text)
+        except speech_recognition.UnknownValueError:
+            profiler.count('no speech')
+            return ''
+
+    async def post(self, headers: dict, body: bytes) -> (int, str, str, int):
+        head = [f'POST {self.target} HTTP/1.1', f'Host: {self.host}', f'Content-Length: {len(body)}',
+                'Connection: keep-alive'] + [f'{key}: {value}' for key, value in headers.items()]
+        request = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+        async with self.slots:
+            # an idle connection may have been closed by the server meanwhile: retry once on a new one
+            connected = 0
+            for reused in ([True, False] if self.idle else [False]):
+                if reused and self.idle:
+                    connection = self.idle.pop()
+                else:
+                    connection = await self.connect()
+                    connected += 1
+                reader, writer = connection
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, reason, data, keep = await asyncio.wait_for(self.response(reader), self.timeout)
+                except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError) as ex:
+                    writer.close()
+                    if reused and not isinstance(ex, asyncio.TimeoutError):
+                        continue
+                    raise TransientRecognitionError(f'{ex!r}') from ex
+                except ValueError as ex:
+                    # a malformed reply: the connection is in an unknown state
+                    writer.close()
+                    raise TransientRecognitionError(f'malformed response: {ex!r}') from ex
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep:
+                    self.idle.append(connection)
+                else:
+                    writer.close()
+                return status, reason, data.decode('utf-8', errors='replace'), connected
+
+    async def connect(self) -> (asyncio.StreamReader, asyncio.StreamWriter):
+        try:
+            connection = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl),
+                                                self.timeout)
+        except (OSError, asyncio.TimeoutError) as ex:
+            raise TransientRecognitionError(f'{ex!r}') from ex
+        self.opened += 1
+        return connection
+
+    @staticmethod
+    async def response(reader: asyncio.StreamReader) -> (int, str, bytes, bool):
+        '''
+            Reads one HTTP/1.x response: status, reason, body and whether the connection stays open
+        '''
+        line = await reader.readline()
+        if not line:
+            raise EOFError('connection closed')
+        version, status, reason = (line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n'):
+                break
+            if not line:
+                raise EOFError('connection closed')
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        keep = headers.get('connection', '').lower() != 'close' if version == 'HTTP/1.1' \
+            else headers.get('connection', '').lower() == 'keep-alive'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                parts.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(parts)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data, keep = await reader.read(), False
+        return int(status), reason, data, keep
+
+    async def shutdown(self) -> None:
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+    def close(self) -> None:
+        if self.loop.is_closed():
+            return
+        self.call(self.shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,86 @@
+import json
+import mmap
+import os
+
+from pydub import AudioSegment
+
+
+class AudioCache:
+    '''
+        Decoded and resampled sources in cacheDir: <hash>_<rate>.pcm with raw
+        PCM and <hash>_<rate>.json with its format. Hits are memory-mapped,
+        so a repeated split of the same book does not decode it again.
+        Least recently used entries are evicted once the cache exceeds max_mb,
+        sources larger than max_mb are not cached.
+    '''
+    DIR = 'audio_cache'
+
+    def __init__(self, cacheDir: str = DIR, max_mb: int = 2048):
+        self.cacheDir = cacheDir
+        self.max_bytes = max_mb * 2**20
+
+    @staticmethod
+    def key(source_hash: str, framerate: int) -> str:
+        return f'{source_hash}_{framerate if framerate > 0 else "native"}'
+
+    def load(self, key: str) -> AudioSegment:
+        dataPath, metaPath = f'{self.cacheDir}/{key}.pcm', f'{self.cacheDir}/{key}.json'
+        try:
+            with open(metaPath, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(dataPath, 'rb') as f:
+                if os.fstat(f.fileno()).st_size != meta['bytes']:
+                    return None
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if meta['bytes'] else b''
+            os.utime(dataPath)
+        except (OSError, ValueError, KeyError):
+            return None
+        # slices of an mmap are bytes, only the touched chunks are copied
+        return AudioSegment(data=data, sample_width=meta['sample_width'],
+                            frame_rate=meta['frame_rate'], channels=meta['channels'])
+
+    def store(self, key: str, sound: AudioSegment) -> None:
+        '''
+            A source larger than the whole cache is not stored: evict() keeps
+            the entry just stored, so it would stay over max_bytes for good
+        '''
+        if len(sound.raw_data) > self.max_bytes:
+            return
+        os.makedirs(self.cacheDir, exist_ok=True)
+        dataPath, metaPath = f'{self.cacheDir}/{key}.pcm', f'{self.cacheDir}/{key}.json'
+        meta = {'bytes': len(sound.raw_data), 'sample_width': sound.sample_width,
+                'frame_rate': sound.frame_rate, 'channels': sound.channels}
+        try:
+            with open(f'{dataPath}.part', 'wb') as f:
+                f.write(sound.raw_data)
+            os.replace(f'{dataPath}.part', dataPath)
+            with open(metaPath, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        except OSError:
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep: str = None) -> None:
+        '''
+            Removes least recently used entries until the cache fits max_bytes
+        '''
+        entries = []
+        for file in os.listdir(self.cacheDir):
+            if not file.endswith('.pcm'):
+                continue
+            stat = os.stat(f'{self.cacheDir}/{file}')
+            entries.append((stat.st_mtime, stat.st_size, file[:-len('.pcm')]))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(f'{self.cacheDir}/{key}.pcm')
+            except OSError:
+                # still mapped by another run (Windows)
+                continue
+            if os.path.isfile(f'{self.cacheDir}/{key}.json'):
+                os.remove(f'{self.cacheDir}/{key}.json')
+            total -= size
@@ -0,0 +1,207 @@
+import os
+import json
+
+from PyQt5 import QtWidgets
+from processing import ProcessingThread
+from utils import is_path_to_audio, is_path_to_txt
+from timings import is_path_to_timings
+
+
+def pair_folder(folder: str) -> list:
+    '''
+        (audio, text) pairs with the same basename, sorted by name
+    '''
+    audios, texts = {}, {}
+    for file in sorted(os.listdir(folder)):
+        name = file.rsplit('.', 1)[0]
+        if is_path_to_audio(file):
+            audios.setdefault(name, f'{folder}/{file}')
+        elif is_path_to_txt(file) or is_path_to_timings(file):
+            texts.setdefault(name, f'{folder}/{file}')
+    return [(audios[name], texts[name]) for name in sorted(audios) if name in texts]
+
+
+class BatchJob:
+    def __init__(self, audioPath: str, txtPath: str, outdirPath: str):
+        self.audioPath = audioPath
+        self.txtPath = txtPath
+        self.outdirPath = outdirPath
+        self.status = 'Queued'
+        self.thread = None
+
+
+class Batchwindow(QtWidgets.QMainWindow):
+    '''
+        Queue of audio/text pairs processed by up to max_parallel_jobs ProcessingThreads.
+        Every pair gets its own <outdir>/<basename> folder
+    '''
+    COLUMNS = ['Audio', 'Text', 'Outdir', 'Status']
+
+    def __init__(self):
+        super(Batchwindow, self).__init__()
+        self.setWindowTitle('Batch queue')
+        self.resize(900, 400)
+        self.jobs = []
+        with open('params.json', 'r') as params_json:
+            self.params = json.load(params_json)
+        self.loadUi()
+
+    def loadUi(self):
+        central = QtWidgets.QWidget(self)
+        layout = QtWidgets.QVBoxLayout(central)
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS), central)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        buttons = QtWidgets.QHBoxLayout()
+        self.addPairBt = QtWidgets.QPushButton('Add pair', central)
+        self.addFolderBt = QtWidgets.QPushButton('Add folder', central)
+        self.removeBt = QtWidgets.QPushButton('Remove selected', central)
+        self.parallelSB = QtWidgets.QSpinBox(central)
+        self.parallelSB.setRange(1, 64)
+        self.parallelSB.setValue(self.params.get('max_parallel_jobs', 2))
+        self.parallelSB.setPrefix('parallel jobs: ')
+        self.startBt = QtWidgets.QPushButton('Start', central)
+        self.cancelBt = QtWidgets.QPushButton('Cancel all', central)
+        for widget in [self.addPairBt, self.addFolderBt, self.removeBt]:
+            buttons.addWidget(widget)
+        buttons.addStretch(1)
+        for widget in [self.parallelSB, self.startBt, self.cancelBt]:
+            buttons.addWidget(widget)
+        layout.addLayout(buttons)
+        self.setCentralWidget(central)
+
+        self.addPairBt.clicked.connect(self.addPairClicked)
+        self.addFolderBt.clicked.connect(self.addFolderClicked)
+        self.removeBt.clicked.connect(self.removeClicked)
+        self.parallelSB.valueChanged.connect(self.parallelChanged)
+        self.startBt.clicked.connect(self.startJobs)
+        self.cancelBt.clicked.connect(self.cancelClicked)
+
+    def outdirDialog(self) -> str:
+        default_dir = self.params.get('default_out_dir', '.')
+        if default_dir != '.' and not os.path.isdir(default_dir):
+            default_dir = '.'
+        return QtWidgets.QFileDialog.getExistingDirectory(self, 'Select outdir', default_dir)
+
+    def addJob(self, audioPath: str, txtPath: str, outdir: str):
+        name = os.path.basename(audioPath).rsplit('.', 1)[0]
+        job = BatchJob(audioPath, txtPath, f'{outdir}/{name}')
+        self.jobs.append(job)
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        for column, value in enumerate([job.audioPath, job.txtPath, job.outdirPath, job.status]):
+            self.table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+
+    def addPairClicked(self):
+        default_dir = self.params.get('default_audio_dir', '.')
+        if default_dir != '.' and not os.path.isdir(default_dir):
+            default_dir = '.'
+        audio = QtWidgets.QFileDialog.getOpenFileName(self, 'Select audio', default_dir, "Audios (*.mp3 *.wav *.flac)")[0]
+        if audio == '':
+            return
+        txt = f'{audio.rsplit(".", 1)[0]}.txt'
+        if not os.path.isfile(txt):
+            txt = QtWidgets.QFileDialog.getOpenFileName(self, 'Select txt', os.path.dirname(audio), "Txt (*.txt *.lab *.TextGrid *.srt *.vtt)")[0]
+            if txt == '':
+                return
+        outdir = self.outdirDialog()
+        if outdir != '':
+            self.addJob(audio, txt, outdir)
+
+    def addFolderClicked(self):
+        default_dir = self.params.get('default_audio_dir', '.')
+        if default_dir != '.' and not os.path.isdir(default_dir):
+            default_dir = '.'
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, 'Select folder with audio and txt', default_dir)
+        if folder == '':
+            return
+        pairs = pair_folder(folder)
+        if len(pairs) == 0:
+            return
+        outdir = self.outdirDialog()
+        if outdir == '':
+            return
+        for audio, txt in pairs:
+            self.addJob(audio, txt, outdir)
+
+    def removeClicked(self):
+        rows = sorted({index.row() for index in self.table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            if self.jobs[row].status == 'Running':
+                continue
+            self.jobs.pop(row)
+            self.table.removeRow(row)
+
+    def parallelChanged(self, value):
+        self.params['max_parallel_jobs'] = value
+        with open('params.json', 'r') as params_json:
+            params = json.load(params_json)
+        params['max_parallel_jobs'] = value
+        with open('params.json', 'w') as params_json:
+            json.dump(params, params_json)
+        # a raised limit takes effect in a running queue only, Start begins one
+        if any(job.status == 'Running' for job in self.jobs):
+            self.startJobs()
+
+    def setStatus(self, job: BatchJob, status: str):
+        job.status = status
+        row = self.jobs.index(job)
+        self.table.item(row, len(self.COLUMNS)-1).setText(status)
+
+    def startJobs(self):
+        with open('params.json', 'r') as params_json:
+            self.params = json.load(params_json)
+        running = sum(job.status == 'Running' for job in self.jobs)
+        for job in self.jobs:
+            if running >= self.parallelSB.value():
+                break
+            if job.status != 'Queued':
+                continue
+            if not os.path.isdir(job.outdirPath):
+                os.mkdir(job.outdirPath)
+            job.thread = ProcessingThread(self)
+            job.thread.audioPath = job.audioPath
+            job.thread.txtPath = job.txtPath
+            job.thread.outdirPath = job.outdirPath
+            job.thread.setParams(self.params)
+            job.thread.progress_signal.connect(
+                lambda stage, done, total, rate, eta, job=job: self.jobProgress(job, stage, done, total, eta))
+            job.thread.finish_signal.connect(
+                lambda completed, summary, error, job=job: self.jobFinished(job, completed, summary, error))
+            self.setStatus(job, 'Running')
+            job.thread.start()
+            running += 1
+
+    def jobProgress(self, job, stage, done, total, eta):
+        if job.status != 'Running':
+            return
+        status = f'{stage}: {done}/{total}'
+        if eta >= 0:
+            status += f', ETA {int(eta)} sec'
+        self.table.item(self.jobs.index(job), len(self.COLUMNS)-1).setText(status)
+
+    def jobFinished(self, job, completed, summary, error):
+        if error is not None:
+            self.setStatus(job, f'Failed: {error}')
+        else:
+            self.setStatus(job, f'Done; {summary}' if completed else 'Cancelled')
+        self.startJobs()
+
+    def cancelClicked(self):
+        for job in self.jobs:
+            if job.status == 'Queued':
+                self.setStatus(job, 'Cancelled')
+            elif job.status == 'Running':
+                job.thread.requestInterruption()
+
+    def closeEvent(self, event):
+        self.cancelClicked()
+        for job in self.jobs:
+            if job.thread is not None:
+                job.thread.wait()
+        super(Batchwindow, self).closeEvent(event)
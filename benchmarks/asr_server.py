@@ -0,0 +1,69 @@
+import asyncio
+import json
+import threading
+
+
+class StandInServer:
+    '''
+        Local stand-in of the Google Speech API for benchmarks: answers every
+        POST with a fixed transcript after `latency` seconds. A new connection
+        costs `handshake` seconds first, like a TLS setup would.
+        Keep-alive is honoured unless the client asks for Connection: close
+    '''
+    def __init__(self, latency: float = 0.02, handshake: float = 0.05, transcript: str = 'раз два три'):
+        self.latency = latency
+        self.handshake = handshake
+        self.body = (json.dumps({'result': []}) + '\n' +
+                     json.dumps({'result': [{'alternative': [{'transcript': transcript, 'confidence': 0.9}],
+                                             'final': True}], 'result_index': 0}, ensure_ascii=False) + '\n'
+                     ).encode('utf-8')
+        self.connections = 0
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.handle, '127.0.0.1', 0, backlog=1024), self.loop).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/speech-api/v2/recognize'
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        await asyncio.sleep(self.handshake)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                await reader.readexactly(int(headers.get('content-length', 0)))
+                await asyncio.sleep(self.latency)
+                self.requests += 1
+                close = headers.get('connection', '').lower() == 'close'
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json; charset=utf-8\r\n' +
+                             f'Content-Length: {len(self.body)}\r\nConnection: {"close" if close else "keep-alive"}'
+                             f'\r\n\r\n'.encode('latin-1') + self.body)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import sys
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import speech_recognition
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_book, make_text, make_words, StubRecognizer, FlakyRecognizer
+from utils import safe_audiosegment, split_audio_by_pauses, StringComparison, text_difference
+from pipeline import Pipeline
+from recognition import recognition_payload
+from segmentation import chunk_pauses, select_segments, PAUSE_WEIGHT
+from silence import iter_nonsilent
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
+from async_recognizer import AsyncRecognizer
+from asr_server import StandInServer
+
+
+def measure(func, repeat: int = 1) -> (float, int):
+    '''
+        Best wall time of repeat calls and peak traced memory in bytes.
+        tracemalloc slows Python code down many times over, so the timed
+        calls run untraced and memory is taken from one more, traced call
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def bench_audio(workdir: str, words: int, repeat: int) -> dict:
+    audioPath, _, phrases = make_book(f'{workdir}/audio', words)
+    seconds = safe_audiosegment(audioPath, -1).duration_seconds
+    results = {}
+
+    elapsed, peak = measure(lambda: safe_audiosegment(audioPath, 16000), repeat)
+    results['safe_audiosegment'] = {'sec': elapsed, 'peak_mb': peak / 2**20, 'audio_sec_per_sec': seconds / elapsed}
+
+    def split():
+        outdir = f'{workdir}/split'
+        shutil.rmtree(outdir, ignore_errors=True)
+        os.makedirs(outdir)
+        split_audio_by_pauses(audioPath, outdir, min_sec=1, max_sec=25)
+    elapsed, peak = measure(split, repeat)
+    results['split_audio_by_pauses'] = {'sec': elapsed, 'peak_mb': peak / 2**20, 'audio_sec_per_sec': seconds / elapsed}
+    return results
+
+
+def bench_find(sizes: list, queries: int) -> dict:
+    results = {}
+    for size in sizes:
+        text, phrases = make_text(make_words(size))
+        recognizer = StubRecognizer(phrases)
+        step = max(len(phrases) // queries, 1)
+        asr = [recognizer(f'book_{str(i+1).zfill(5)}.wav') for i in range(0, len(phrases), step)][:queries]
+        sc = StringComparison(text)
+        elapsed, peak = measure(lambda: [sc.find(query) for query in asr])
+        results[f'StringComparison.find[{size} words]'] = {'sec': elapsed, 'peak_mb': peak / 2**20,
+                                                            'queries_per_sec': len(asr) / elapsed}
+    return results
+
+
+def bench_diff(count: int) -> dict:
+    _, phrases = make_text(make_words(count * 12))
+    recognizer = StubRecognizer(phrases, drop=0.2)
+    pairs = [(phrase, recognizer(f'book_{str(i+1).zfill(5)}.wav')) for i, phrase in enumerate(phrases)]
+    elapsed, peak = measure(lambda: [text_difference(original, asr) for original, asr in pairs])
+    results = {'text_difference': {'sec': elapsed, 'peak_mb': peak / 2**20, 'diffs_per_sec': len(pairs) / elapsed}}
+
+    # 25 sec chunks (about 8 phrases)
+    chunks = [' '.join(phrases[i:i + 8]) for i in range(0, len(phrases) - 8, 8)]
+    recognizer = StubRecognizer(chunks, drop=0.1)
+    pairs = [(chunk, recognizer(f'book_{str(i+1).zfill(5)}.wav')) for i, chunk in enumerate(chunks)]
+    elapsed, peak = measure(lambda: [text_difference(original, asr) for original, asr in pairs])
+    results['text_difference[long chunks]'] = {'sec': elapsed, 'peak_mb': peak / 2**20,
+                                               'diffs_per_sec': len(pairs) / elapsed}
+    return results
+
+
+def bench_pipeline(workdir: str, words: int) -> dict:
+    audioPath, txtPath, phrases = make_book(f'{workdir}/pipeline', words)
+    seconds = safe_audiosegment(audioPath, -1).duration_seconds
+    outdir = f'{workdir}/pipeline/outdir'
+
+    def run():
+        shutil.rmtree(outdir, ignore_errors=True)
+        Pipeline(audioPath, txtPath, outdir, min_sec=1, max_sec=25, recognize=StubRecognizer(phrases)).run()
+    elapsed, peak = measure(run)
+    results = {'pipeline': {'sec': elapsed, 'peak_mb': peak / 2**20, 'audio_sec_per_sec': seconds / elapsed}}
+
+    recognizer = FlakyRecognizer(phrases, failure=0.3, latency=0.01)
+
+    def run_flaky():
+        shutil.rmtree(outdir, ignore_errors=True)
+        recognizer.failures = 0
+        Pipeline(audioPath, txtPath, outdir, min_sec=1, max_sec=25, recognize=recognizer,
+                 requests_per_sec=200, recognize_retries=8, recognize_backoff=0.01).run()
+    elapsed, peak = measure(run_flaky)
+    written = len([name for name in os.listdir(outdir) if name.endswith('.txt')])
+    results['pipeline[30% transient errors]'] = {'sec': elapsed, 'peak_mb': peak / 2**20,
+                                                 'audio_sec_per_sec': seconds / elapsed, 'samples': written,
+                                                 'retries': recognizer.failures}
+    return results
+
+
+def bench_recognizer(count: int, workers: int = 16, latency: float = 0.02, handshake: float = 0.05) -> dict:
+    '''
+        count 3 sec chunks against a local stand-in server, workers requests at once:
+        a new connection per request (speech_recognize) vs the pooled client
+    '''
+    samples = np.random.default_rng(0).integers(-3000, 3000, size=(3 * 16000, 1)).astype(np.int16)
+    payload = recognition_payload('book_00001.wav', samples, 16000)
+    results = {}
+    with StandInServer(latency, handshake) as server:
+        # connections opened by each call, the first one is the timed run
+        opened = []
+
+        def counted(func):
+            before = server.connections
+            func()
+            opened.append(server.connections - before)
+
+        def per_request(_):
+            return speech_recognition.Recognizer().recognize_google(payload, language='ru-RU', endpoint=server.url)
+        with ThreadPoolExecutor(workers) as executor:
+            elapsed, peak = measure(lambda: counted(lambda: list(executor.map(per_request, range(count)))))
+        results['recognize[connection per request]'] = {'sec': elapsed, 'peak_mb': peak / 2**20,
+                                                        'requests_per_sec': count / elapsed,
+                                                        'connections': opened[0]}
+
+        opened = []
+        with AsyncRecognizer(connections=workers, endpoint=server.url) as client, ThreadPoolExecutor(workers) as executor:
+            elapsed, peak = measure(lambda: counted(lambda: list(executor.map(lambda _: client(payload), range(count)))))
+        results['recognize[pooled connections]'] = {'sec': elapsed, 'peak_mb': peak / 2**20,
+                                                    'requests_per_sec': count / elapsed,
+                                                    'connections': opened[0]}
+    return results
+
+
+def random_ranges(rng: np.random.Generator, count: int) -> list:
+    gaps = rng.integers(0, 3000, count)
+    lengths = rng.integers(300, 12000, count)
+    starts = np.cumsum(gaps + np.concatenate([[0], lengths[:-1]]))
+    return np.stack([starts, starts + lengths], axis=1).tolist()
+
+
+def reference_score(ranges: list, pauses: list, min_ms: int, max_ms: int, pause_weight: float = PAUSE_WEIGHT) -> float:
+    '''
+        Best score select_segments can reach, by the plain O(n^2) DP over all segments
+    '''
+    cut = [0.0] + [pause_weight * pause for pause in pauses] + [0.0]
+    best = [0.0] * (len(ranges) + 1)
+    for j in range(len(ranges)):
+        best[j + 1] = best[j]
+        voiced = 0
+        for i in range(j, -1, -1):
+            voiced += ranges[i][1] - ranges[i][0]
+            length = ranges[j][1] - ranges[i][0]
+            if length > max_ms:
+                break
+            if length >= min_ms:
+                best[j + 1] = max(best[j + 1], best[i] + voiced + cut[i] + cut[j + 1])
+    return best[-1]
+
+
+def segments_score(segments: list, ranges: list, pauses: list, pause_weight: float = PAUSE_WEIGHT) -> float:
+    cut = [0.0] + [pause_weight * pause for pause in pauses] + [0.0]
+    first = {start: i for i, (start, _) in enumerate(ranges)}
+    last = {end: j for j, (_, end) in enumerate(ranges)}
+    return sum(sum(end - start for start, end in ranges[first[s]:last[e] + 1]) + cut[first[s]] + cut[last[e] + 1]
+               for s, e in segments)
+
+
+def bench_segments(count: int, checks: int = 300) -> dict:
+    '''
+        select_segments on count ranges; on checks small random inputs its
+        segments must score as high as the O(n^2) reference DP
+    '''
+    rng = np.random.default_rng(0)
+    mismatches = 0
+    for _ in range(checks):
+        ranges = random_ranges(rng, int(rng.integers(1, 40)))
+        pauses = chunk_pauses(ranges, 0)
+        min_ms, max_ms = int(rng.integers(500, 5000)), int(rng.integers(5000, 30000))
+        segments = select_segments(ranges, pauses, min_ms, max_ms)
+        if abs(segments_score(segments, ranges, pauses) - reference_score(ranges, pauses, min_ms, max_ms)) > 1e-6 or \
+                any(not min_ms <= end - start <= max_ms for start, end in segments):
+            mismatches += 1
+    if mismatches:
+        raise AssertionError(f'select_segments is not optimal on {mismatches} of {checks} inputs')
+
+    ranges = random_ranges(rng, count)
+    pauses = chunk_pauses(ranges, 0)
+    elapsed, peak = measure(lambda: select_segments(ranges, pauses, 3001, 24999))
+    return {'select_segments': {'sec': elapsed, 'peak_mb': peak / 2**20, 'ranges_per_sec': count / elapsed}}
+
+
+def speech_and_pauses(rng: np.random.Generator, sample_width: int, pairs: int, frame_rate: int = 8000) -> AudioSegment:
+    '''
+        pairs of noise at about -20 dBFS and near silence, sample_width bytes PCM
+    '''
+    full_scale = 2 ** (8*sample_width - 1)
+    parts = []
+    for _ in range(pairs):
+        parts.append(rng.standard_normal(int(rng.integers(2, 9)) * frame_rate) * 0.1 * full_scale)
+        parts.append(rng.standard_normal(int(rng.integers(900, 3000)) * frame_rate // 1000) * 3)
+    samples = np.clip(np.concatenate(parts), -full_scale, full_scale - 1)
+    return AudioSegment(samples.astype({1: np.int8, 2: np.int16, 4: np.int32}[sample_width]).tobytes(),
+                        frame_rate=frame_rate, sample_width=sample_width, channels=1)
+
+
+def bench_silence(pairs: int = 20) -> dict:
+    '''
+        iter_nonsilent must find the ranges of pydub detect_nonsilent on
+        16-bit and 32-bit sources (24-bit ones are padded to 32 by pydub)
+    '''
+    rng = np.random.default_rng(0)
+    results = {}
+    for sample_width in (2, 4):
+        sound = speech_and_pauses(rng, sample_width, pairs)
+        expected = detect_nonsilent(sound, 800, -50, 10)
+        found = list(iter_nonsilent(sound, 800, -50, 10, block_ms=30000))
+        if found != expected:
+            raise AssertionError(f'iter_nonsilent finds {len(found)} ranges instead of {len(expected)} '
+                                 f'in {8*sample_width}-bit audio')
+        elapsed, peak = measure(lambda: list(iter_nonsilent(sound, 800, -50, 10)))
+        results[f'iter_nonsilent[{8*sample_width}-bit]'] = {'sec': elapsed, 'peak_mb': peak / 2**20,
+                                                          'audio_sec_per_sec': sound.duration_seconds / elapsed}
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    return [f'{name}: {result["sec"]:.3f}s vs {baseline[name]["sec"]:.3f}s'
+            for name, result in results.items()
+            if name in baseline and result['sec'] > baseline[name]['sec'] * (1 + tolerance)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the processing hot paths on a synthetic audiobook')
+    parser.add_argument('--words', type=int, default=3000, help='words in the synthetic audiobook')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000, 100000],
+                        help='book sizes (words) for StringComparison.find')
+    parser.add_argument('--queries', type=int, default=50, help='find() calls per book size')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='save results as json')
+    parser.add_argument('--baseline', help='results json to compare with; exit code 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against baseline')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='dataset_bench_')
+    try:
+        results = {}
+        results.update(bench_audio(workdir, args.words, args.repeat))
+        results.update(bench_find(args.sizes, args.queries))
+        results.update(bench_diff(args.queries * 10))
+        results.update(bench_pipeline(workdir, args.words))
+        results.update(bench_recognizer(args.queries * 4))
+        results.update(bench_segments(50000))
+        results.update(bench_silence())
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, result in results.items():
+        print(f'{name:40} ' + '  '.join(f'{key}={value:.3f}' for key, value in result.items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+import wave
+import numpy as np
+
+from recognition import TransientRecognitionError
+
+SYLLABLES = ['ка', 'ло', 'ми', 'ра', 'то', 'ну', 'се', 'да', 'по', 'ви', 'ге', 'жу', 'зо', 'ли', 'ста', 'про']
+WORDS_PER_SEC = 3.0
+
+
+def make_words(count: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    vocabulary = [''.join(rng.choice(SYLLABLES, size=rng.integers(1, 4))) for _ in range(2000)]
+    return [vocabulary[i] for i in rng.integers(0, len(vocabulary), size=count)]
+
+
+def make_text(words: list, phrase_len: int = 12) -> (str, list):
+    '''
+        Returns the book text and its phrases (one phrase is one spoken chunk)
+    '''
+    phrases = [' '.join(words[i:i+phrase_len]) for i in range(0, len(words), phrase_len)]
+    text = '\n'.join(f'{phrase[0].upper()}{phrase[1:]}.' for phrase in phrases)
+    return text, phrases
+
+
+def make_speech(phrases: list, framerate: int = 22050, pause_sec: float = 1.0, seed: int = 0) -> np.ndarray:
+    '''
+        Harmonic "voice" with syllable-rate envelope for every phrase,
+        separated by low-level noise pauses of pause_sec
+    '''
+    rng = np.random.default_rng(seed)
+    parts = []
+    for phrase in phrases:
+        seconds = len(phrase.split(' ')) / WORDS_PER_SEC
+        t = np.arange(int(seconds * framerate)) / framerate
+        f0 = rng.uniform(100, 220) * (1 + 0.05*np.sin(2*np.pi*0.5*t))
+        phase = 2*np.pi*np.cumsum(f0) / framerate
+        voice = sum(np.sin(k*phase) / k for k in range(1, 6))
+        envelope = 0.55 + 0.45*np.sin(2*np.pi*WORDS_PER_SEC*t)
+        parts.append(0.3 * voice * envelope + rng.normal(0, 0.003, len(t)))
+        parts.append(rng.normal(0, 0.0003, int(pause_sec * framerate)))
+    signal = np.concatenate(parts)
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def write_wav(path: str, samples: np.ndarray, framerate: int = 22050) -> None:
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(framerate)
+        w.writeframes(samples.tobytes())
+
+
+def make_book(outdir: str, words: int, framerate: int = 22050, seed: int = 0) -> (str, str, list):
+    '''
+        Writes book.wav/book.txt to outdir, returns their paths and the phrases
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    text, phrases = make_text(make_words(words, seed))
+    audioPath, txtPath = f'{outdir}/book.wav', f'{outdir}/book.txt'
+    write_wav(audioPath, make_speech(phrases, framerate, seed=seed), framerate)
+    with open(txtPath, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return audioPath, txtPath, phrases
+
+
+class StubRecognizer:
+    '''
+        Recognizer stand-in: returns the phrase of the chunk (by its _00001 suffix)
+        with a share of words dropped, like a noisy ASR would
+    '''
+    def __init__(self, phrases: list, drop: float = 0.1, seed: int = 0):
+        self.phrases = phrases
+        self.drop = drop
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, audio) -> str:
+        filename = getattr(audio, 'name', audio)  # recognition payloads carry the sample name
+        idx = int(filename.rsplit('_', 1)[-1].split('.', 1)[0]) - 1
+        if not 0 <= idx < len(self.phrases):
+            return ''
+        words = [word for word in self.phrases[idx].split(' ') if self.rng.random() >= self.drop]
+        return ' '.join(words)
+
+
+class FlakyRecognizer(StubRecognizer):
+    '''
+        StubRecognizer behind an unreliable service: a share of requests
+        fails with TransientRecognitionError after latency seconds
+    '''
+    def __init__(self, phrases: list, failure: float = 0.3, latency: float = 0.0, drop: float = 0.1, seed: int = 0):
+        super().__init__(phrases, drop, seed)
+        self.failure = failure
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def __call__(self, audio) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            failed = self.rng.random() < self.failure
+            self.failures += failed
+        if failed:
+            raise TransientRecognitionError('503 Service Unavailable')
+        return super().__call__(audio)
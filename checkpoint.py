@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+
+
+class Checkpoint:
+    '''
+        Append-only journal of a processing run in outdir/checkpoint.jsonl.
+        The first line identifies the run (source hash and split params);
+        every other line is one event, replayed on load:
+            chunks      - detected chunk ranges, ms
+            chunk       - one more chunk range while detection is running; the
+                          list is complete once the 'detect' stage is journaled
+            split       - chunk index handled by the splitter, name of the exported file or None
+            recognized  - raw recognizer output for a sample
+            failed      - the recognizer gave up on a sample, it is retried on the next run
+            aligned     - sample written (or rejected) with its accuracy and position
+            stage       - a stage is complete
+    '''
+    FILE = 'checkpoint.jsonl'
+
+    def __init__(self, outdir: str):
+        self.path = f'{outdir}/{self.FILE}'
+        self.lock = threading.Lock()
+        self.header = None
+        self.clear()
+
+    def clear(self) -> None:
+        self.chunks = None
+        self.chunks_complete = False
+        self.split = {}
+        self.recognized = {}
+        self.failed = {}
+        self.aligned = {}
+        self.stages = set()
+
+    def read(self) -> dict:
+        '''
+            Replays the existing journal whatever run it belongs to; returns its header
+        '''
+        self.clear()
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        if not lines:
+            return None
+        for line in lines[1:]:
+            event = self.parse(line)
+            if event is not None:
+                self.replay(event)
+        return self.parse(lines[0])
+
+    def open(self, source_hash: str, params: dict) -> bool:
+        '''
+            Loads the journal; starts a new one if it belongs to another source or params.
+            Returns True if the run is resumed
+        '''
+        header = {'source_hash': source_hash, 'params': params}
+        if self.read() == header:
+            self.header = header
+            return True
+
+        self.clear()
+        self.header = header
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        return False
+
+    @staticmethod
+    def parse(line: str) -> dict:
+        # the last line may be cut off by a crash
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def replay(self, event: dict) -> None:
+        kind = event['event']
+        if kind == 'chunks':
+            self.chunks = event['ranges']
+            self.chunks_complete = True
+        elif kind == 'chunk':
+            if self.chunks is None:
+                self.chunks = []
+            self.chunks.append(event['range'])
+        elif kind == 'split':
+            self.split[event['index']] = event['name']
+        elif kind == 'recognized':
+            self.recognized[event['name']] = event['text']
+            self.failed.pop(event['name'], None)
+        elif kind == 'failed':
+            self.failed[event['name']] = event['error']
+        elif kind == 'aligned':
+            self.aligned[event['name']] = event
+        elif kind == 'stage':
+            self.stages.add(event['stage'])
+            if event['stage'] == 'detect':
+                self.chunks_complete = True
+
+    def append(self, event: dict) -> None:
+        with self.lock:
+            self.replay(event)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def set_chunks(self, ranges: list) -> None:
+        self.append({'event': 'chunks', 'ranges': ranges})
+
+    def add_chunk(self, chunk_range: list) -> None:
+        self.append({'event': 'chunk', 'range': chunk_range})
+
+    def set_split(self, index: int, name: str) -> None:
+        self.append({'event': 'split', 'index': index, 'name': name})
+
+    def set_recognized(self, name: str, text: str) -> None:
+        self.append({'event': 'recognized', 'name': name, 'text': text})
+
+    def set_failed(self, name: str, error: str) -> None:
+        self.append({'event': 'failed', 'name': name, 'error': error})
+
+    def set_aligned(self, name: str, rate: int, position: int, written: bool) -> None:
+        self.append({'event': 'aligned', 'name': name, 'rate': rate, 'position': position, 'written': written})
+
+    def set_stage(self, stage: str) -> None:
+        self.append({'event': 'stage', 'stage': stage})
+
+    def split_done(self) -> bool:
+        return 'split' in self.stages
+
+    def resume_index(self) -> int:
+        '''
+            First chunk index the splitter has not handled yet
+        '''
+        idx = 0
+        while idx in self.split:
+            idx += 1
+        return idx
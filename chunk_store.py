@@ -0,0 +1,126 @@
+import io
+import json
+import os
+import threading
+import wave
+import numpy as np
+
+from pydub import AudioSegment
+
+
+class ChunkStore:
+    '''
+        All chunks of an outdir in one PCM file (chunks.pcm) with an
+        append-only index (chunks.index.jsonl). Chunks keep their usual
+        sample names (book_00001.wav) and are read as zero-copy memmap slices.
+    '''
+    DATA = 'chunks.pcm'
+    INDEX = 'chunks.index.jsonl'
+
+    def __init__(self, outdir: str):
+        self.dataPath = f'{outdir}/{self.DATA}'
+        self.indexPath = f'{outdir}/{self.INDEX}'
+        self.lock = threading.Lock()
+        self.index = {}
+        self.rejected = {}
+        self.map = None
+        if os.path.isfile(self.indexPath):
+            with open(self.indexPath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('removed'):
+                        removed = self.index.pop(entry['name'], None)
+                        if removed is not None and entry.get('rejected'):
+                            self.rejected[entry['name']] = removed
+                    else:
+                        self.index[entry['name']] = entry
+                        self.rejected.pop(entry['name'], None)
+
+    @classmethod
+    def exists(cls, outdir: str) -> bool:
+        return os.path.isfile(f'{outdir}/{cls.INDEX}')
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def names(self) -> list:
+        return sorted(self.index)
+
+    def journal(self, entry: dict) -> None:
+        with open(self.indexPath, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def append(self, name: str, segment: AudioSegment) -> None:
+        data = segment.raw_data
+        with self.lock:
+            with open(self.dataPath, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+            entry = {'name': name, 'offset': offset, 'bytes': len(data), 'sample_rate': segment.frame_rate,
+                     'channels': segment.channels, 'sample_width': segment.sample_width}
+            self.journal(entry)
+            self.index[name] = entry
+
+    def remove(self, name: str) -> None:
+        '''
+            Drops the chunk from the index; its bytes stay in chunks.pcm
+        '''
+        with self.lock:
+            if self.index.pop(name, None) is not None:
+                self.journal({'name': name, 'removed': True})
+
+    def reject(self, name: str) -> None:
+        '''
+            Drops the chunk from the index but remembers it, see restore
+        '''
+        with self.lock:
+            entry = self.index.pop(name, None)
+            if entry is not None:
+                self.rejected[name] = entry
+                self.journal({'name': name, 'removed': True, 'rejected': True})
+
+    def restore(self, name: str) -> None:
+        with self.lock:
+            entry = self.rejected.pop(name, None)
+            if entry is not None:
+                self.journal(entry)
+                self.index[name] = entry
+
+    def view(self, name: str) -> memoryview:
+        entry = self.index[name]
+        end = entry['offset'] + entry['bytes']
+        with self.lock:
+            if self.map is None or len(self.map) < end:
+                self.map = np.memmap(self.dataPath, dtype=np.uint8, mode='r')
+            return memoryview(self.map[entry['offset']:end])
+
+    def samples(self, name: str) -> np.ndarray:
+        '''
+            frames x channels int array over the mapped file, no copy
+        '''
+        entry = self.index[name]
+        dtype = {1: np.int8, 2: np.int16, 4: np.int32}[entry['sample_width']]
+        return np.frombuffer(self.view(name), dtype=dtype).reshape(-1, entry['channels'])
+
+    def segment(self, name: str) -> AudioSegment:
+        entry = self.index[name]
+        return AudioSegment(data=bytes(self.view(name)), sample_width=entry['sample_width'],
+                            frame_rate=entry['sample_rate'], channels=entry['channels'])
+
+    def duration_ms(self, name: str) -> int:
+        entry = self.index[name]
+        frame_bytes = entry['sample_width'] * entry['channels']
+        return int(entry['bytes'] / frame_bytes * 1000 / entry['sample_rate'])
+
+    def wav_bytes(self, name: str) -> bytes:
+        entry = self.index[name]
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as w:
+            w.setnchannels(entry['channels'])
+            w.setsampwidth(entry['sample_width'])
+            w.setframerate(entry['sample_rate'])
+            w.writeframes(self.view(name))
+        return buffer.getvalue()
@@ -0,0 +1,190 @@
+import json
+import os
+import numpy as np
+
+from normalize import segment_sums, read_wav_samples
+
+FRAME_MS = 25
+HOP_MS = 10
+MEL_BANDS = 26
+CEPSTRA = 13
+BATCH_CHUNKS = 64
+
+_filterbanks = {}
+
+
+def mel_filterbank(frame_rate: int, n_fft: int) -> np.ndarray:
+    '''
+        MEL_BANDS triangular filters over the n_fft//2+1 rfft bins
+    '''
+    key = (frame_rate, n_fft)
+    if key not in _filterbanks:
+        mel = lambda hz: 2595 * np.log10(1 + hz / 700)
+        hz = lambda m: 700 * (10 ** (m / 2595) - 1)
+        edges = hz(np.linspace(mel(60), mel(min(frame_rate / 2, 8000)), MEL_BANDS + 2))
+        bins = np.fft.rfftfreq(n_fft, 1 / frame_rate)
+        lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+        rising = (bins - lower) / (center - lower)
+        falling = (upper - bins) / (upper - center)
+        _filterbanks[key] = np.maximum(np.minimum(rising, falling), 0).astype(np.float32).T
+    return _filterbanks[key]
+
+
+def dct_matrix() -> np.ndarray:
+    n = np.arange(MEL_BANDS)
+    k = np.arange(CEPSTRA)[:, None]
+    return np.cos(np.pi * k * (2*n + 1) / (2*MEL_BANDS)).astype(np.float32).T
+
+
+def embed_chunks(chunks: list, frame_rate: int) -> np.ndarray:
+    '''
+        chunks: mono float arrays at frame_rate. Returns one row per chunk:
+        mean and std of MFCC 1..CEPSTRA-1 (c0 follows loudness, not the voice).
+        Frames of all chunks go through FFT, mel and DCT as one matrix
+    '''
+    frame = int(frame_rate * FRAME_MS / 1000)
+    hop = int(frame_rate * HOP_MS / 1000)
+    n_fft = 1 << (frame - 1).bit_length()
+    frames, counts = [], []
+    for samples in chunks:
+        if len(samples) < frame:
+            samples = np.pad(samples, (0, frame - len(samples)))
+        count = 1 + (len(samples) - frame) // hop
+        frames.append(np.lib.stride_tricks.as_strided(samples, shape=(count, frame),
+                                                      strides=(hop * samples.strides[0], samples.strides[0])))
+        counts.append(count)
+
+    frames = np.concatenate(frames) * np.hamming(frame).astype(np.float32)
+    power = np.square(np.abs(np.fft.rfft(frames, n_fft))).astype(np.float32)
+    cepstra = np.log(power @ mel_filterbank(frame_rate, n_fft) + 1e-10) @ dct_matrix()
+    cepstra = cepstra[:, 1:]
+
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    lengths = np.array(counts, dtype=np.float32)[:, None]
+    mean = segment_sums(cepstra, starts, ends) / lengths
+    var = segment_sums(np.square(cepstra), starts, ends) / lengths - np.square(mean)
+    return np.hstack([mean, np.sqrt(np.maximum(var, 0))])
+
+
+def cluster_embeddings(embeddings: np.ndarray, threshold: float = 0.7, max_speakers: int = 8) -> np.ndarray:
+    '''
+        Online leader clustering in chunk order: a chunk joins the closest
+        speaker if its cosine distance is below threshold, otherwise starts a
+        new one (up to max_speakers). A final pass reassigns every chunk to
+        the closest resulting centroid. Returns the cluster id per chunk.
+        One voice may end up in several clusters; they are named on confirm
+    '''
+    if len(embeddings) == 0:
+        return np.zeros(0, dtype=np.int64)
+    scaled = (embeddings - embeddings.mean(axis=0)) / (embeddings.std(axis=0) + 1e-6)
+    scaled /= np.linalg.norm(scaled, axis=1, keepdims=True) + 1e-6
+
+    sums = scaled[:1].copy()
+    centroids = scaled[:1].copy()
+    for vector in scaled[1:]:
+        similarity = centroids @ vector
+        best = int(np.argmax(similarity))
+        if 1 - similarity[best] > threshold and len(centroids) < max_speakers:
+            sums = np.vstack([sums, vector])
+            centroids = np.vstack([centroids, vector])
+        else:
+            sums[best] += vector
+            centroids[best] = sums[best] / np.linalg.norm(sums[best])
+
+    labels = np.argmax(scaled @ centroids.T, axis=1)
+    # renumber by first appearance, dropped centroids leave no gaps
+    _, first = np.unique(labels, return_index=True)
+    order = np.argsort(first)
+    remap = np.empty(len(centroids), dtype=np.int64)
+    remap[labels[first[order]]] = np.arange(len(order))
+    return remap[labels]
+
+
+class SpeakerClusters:
+    '''
+        Cluster id of every chunk of an outdir (outdir/clusters.json) and the
+        speaker name the operator gave each cluster on confirm
+    '''
+    FILE = 'clusters.json'
+
+    def __init__(self, outdir: str):
+        self.path = f'{outdir}/{self.FILE}'
+        self.samples = {}
+        self.names = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.samples = data.get('samples', {})
+            self.names = {int(cluster): name for cluster, name in data.get('names', {}).items()}
+
+    @classmethod
+    def exists(cls, outdir: str) -> bool:
+        return os.path.isfile(f'{outdir}/{cls.FILE}')
+
+    def save(self) -> None:
+        with open(f'{self.path}.part', 'w', encoding='utf-8') as f:
+            json.dump({'samples': self.samples, 'names': self.names}, f, ensure_ascii=False)
+        os.replace(f'{self.path}.part', self.path)
+
+    def speaker(self, sample: str) -> str:
+        '''
+            Speaker named for the cluster of a sample (file name), None if
+            the sample was not clustered or its cluster has no name yet
+        '''
+        return self.names.get(self.samples.get(sample))
+
+    def label(self, sample: str) -> str:
+        '''
+            'Speaker N' placeholder of the cluster of a sample, only for display
+        '''
+        cluster = self.samples.get(sample)
+        return None if cluster is None else f'Speaker {cluster + 1}'
+
+    def name(self, sample: str, speaker: str) -> None:
+        cluster = self.samples.get(sample)
+        if cluster is not None and speaker and self.names.get(cluster) != speaker:
+            self.names[cluster] = speaker
+            self.save()
+
+    def cluster(self, outdir: str, names: list, store=None, threshold: float = 0.7, max_speakers: int = 8,
+                tracker=None, cancelled=None) -> bool:
+        '''
+            Embeds the chunks BATCH_CHUNKS at a time and clusters them; chunks
+            are read from the ChunkStore or outdir WAV files, missing ones are skipped.
+            Returns False if cancelled() stopped it
+        '''
+        if tracker is not None:
+            tracker.start('cluster', len(names))
+        found, embeddings = [], []
+        for i in range(0, len(names), BATCH_CHUNKS):
+            if cancelled is not None and cancelled():
+                return False
+            batch, rate = [], None
+            for name in names[i:i + BATCH_CHUNKS]:
+                try:
+                    if store is not None and name in store and not os.path.isfile(f'{outdir}/{name}'):
+                        samples, frame_rate = store.samples(name), store.index[name]['sample_rate']
+                    else:
+                        samples, frame_rate = read_wav_samples(f'{outdir}/{name}')
+                except (OSError, KeyError):
+                    # rejected and removed by the aligner meanwhile
+                    continue
+                if rate is not None and frame_rate != rate:
+                    continue
+                rate = frame_rate
+                batch.append(samples.mean(axis=1, dtype=np.float32))
+                found.append(name)
+            if batch:
+                embeddings.append(embed_chunks(batch, rate))
+            if tracker is not None:
+                tracker.advance('cluster', len(names[i:i + BATCH_CHUNKS]))
+
+        if found:
+            labels = cluster_embeddings(np.vstack(embeddings), threshold, max_speakers)
+            self.samples = {name: int(label) for name, label in zip(found, labels)}
+            self.names = {}
+            self.save()
+        if tracker is not None:
+            tracker.finish('cluster')
+        return True
@@ -0,0 +1,160 @@
+import argparse
+import io
+import json
+import os
+import tarfile
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+
+from utils import log
+
+
+def collect_samples(correct_dir: str) -> list:
+    '''
+        (key, speaker, wav path, txt path) for every confirmed sample,
+        speaker is '' for samples confirmed without one
+    '''
+    samples = []
+    for root, _, files in os.walk(correct_dir):
+        speaker = os.path.relpath(root, correct_dir)
+        speaker = '' if speaker == '.' else speaker
+        for file in sorted(files):
+            if not file.endswith('.wav'):
+                continue
+            name = file.rsplit('.', 1)[0]
+            if not os.path.isfile(f'{root}/{name}.txt'):
+                continue
+            key = f'{speaker}/{name}' if speaker else name
+            samples.append((key, speaker, f'{root}/{file}', f'{root}/{name}.txt'))
+    return sorted(samples)
+
+
+def plan_shards(samples: list, shard_bytes: int) -> list:
+    shards, current, size = [], [], 0
+    for sample in samples:
+        sample_size = os.path.getsize(sample[2])
+        if current and size + sample_size > shard_bytes:
+            shards.append(current)
+            current, size = [], 0
+        current.append(sample)
+        size += sample_size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def read_sample(speaker: str, wav_path: str, txt_path: str) -> (dict, bytes, bytes):
+    '''
+        Metadata, PCM and WAV file data of a sample. Older versions saved
+        confirmed samples as MP3 under a .wav name: those are decoded by
+        pydub and written out as WAV. Returns None if the audio is unreadable
+    '''
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        text = f.read().strip()
+    with open(wav_path, 'rb') as f:
+        data = f.read()
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as w:
+            rate, channels, width, frames = w.getframerate(), w.getnchannels(), w.getsampwidth(), w.getnframes()
+            pcm = w.readframes(frames)
+    except (wave.Error, EOFError):
+        try:
+            audio = AudioSegment.from_file(wav_path)
+        except (CouldntDecodeError, OSError) as ex:
+            log(f'Skipping {wav_path}: {ex}')
+            return None
+        rate, channels, width, frames = audio.frame_rate, audio.channels, audio.sample_width, int(audio.frame_count())
+        pcm = audio.raw_data
+        buffer = io.BytesIO()
+        audio.export(buffer, format='wav')
+        data = buffer.getvalue()
+    meta = {'speaker': speaker, 'text': text, 'sample_rate': rate, 'channels': channels,
+            'sample_width': width, 'frames': frames, 'duration': frames / rate}
+    return meta, pcm, data
+
+
+def add_to_tar(tar: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_tar_shard(path: str, shard: list) -> list:
+    '''
+        WebDataset layout: <key>.wav, <key>.txt and <key>.json next to each other
+    '''
+    manifest = []
+    with tarfile.open(f'{path}.part', 'w') as tar:
+        for key, speaker, wav_path, txt_path in shard:
+            sample = read_sample(speaker, wav_path, txt_path)
+            if sample is None:
+                continue
+            meta, _, data = sample
+            flat_key = key.replace('/', '__')
+            add_to_tar(tar, f'{flat_key}.wav', data)
+            add_to_tar(tar, f'{flat_key}.txt', meta['text'].encode('utf-8'))
+            add_to_tar(tar, f'{flat_key}.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+            manifest.append(dict(meta, key=key, shard=os.path.basename(path)))
+    os.replace(f'{path}.part', path)
+    return manifest
+
+
+def write_pcm_shard(path: str, shard: list) -> list:
+    '''
+        Raw PCM of all samples back to back; offset/frames in the manifest address them
+    '''
+    manifest = []
+    offset = 0
+    with open(f'{path}.part', 'wb') as blob:
+        for key, speaker, wav_path, txt_path in shard:
+            sample = read_sample(speaker, wav_path, txt_path)
+            if sample is None:
+                continue
+            meta, pcm, _ = sample
+            blob.write(pcm)
+            manifest.append(dict(meta, key=key, shard=os.path.basename(path), offset=offset, bytes=len(pcm)))
+            offset += len(pcm)
+    os.replace(f'{path}.part', path)
+    return manifest
+
+
+def export_dataset(outdir: str, dest: str, shard_size_mb: int = 256, fmt: str = 'tar', workers: int = None) -> int:
+    '''
+        Packs outdir/correct into shards in dest plus dest/manifest.jsonl.
+        Returns the number of exported samples
+    '''
+    samples = collect_samples(f'{outdir}/correct')
+    shards = plan_shards(samples, shard_size_mb * 2**20)
+    os.makedirs(dest, exist_ok=True)
+    writer, extension = (write_tar_shard, 'tar') if fmt == 'tar' else (write_pcm_shard, 'pcm')
+    paths = [f'{dest}/shard-{str(i).zfill(6)}.{extension}' for i in range(len(shards))]
+    log(f'Exporting {len(samples)} samples into {len(shards)} shards')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        manifests = list(executor.map(writer, paths, shards))
+
+    with open(f'{dest}/manifest.jsonl', 'w', encoding='utf-8') as f:
+        for manifest in manifests:
+            for entry in manifest:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    exported = sum(len(manifest) for manifest in manifests)
+    if exported < len(samples):
+        log(f'{len(samples) - exported} samples with unreadable audio are skipped')
+    log(f'Dataset exported to {dest}')
+    return exported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack confirmed samples (outdir/correct) into dataset shards')
+    parser.add_argument('outdir', help='processing outdir with the correct/ folder')
+    parser.add_argument('dest', help='folder for the shards and manifest.jsonl')
+    parser.add_argument('--format', choices=['tar', 'pcm'], default='tar',
+                        help='tar: WebDataset tar shards; pcm: raw PCM shards addressed by the manifest')
+    parser.add_argument('--shard-size', type=int, default=256, help='shard size, MB')
+    parser.add_argument('--workers', type=int, default=None, help='parallel shard writers')
+    args = parser.parse_args()
+
+    export_dataset(args.outdir, args.dest, args.shard_size, args.format, args.workers)
@@ -0,0 +1,133 @@
+import wave
+import numpy as np
+from pydub import AudioSegment
+
+ENVELOPE_MS = 10
+SAMPLE_TYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def pcm_array(sound: AudioSegment) -> np.ndarray:
+    '''
+        frames x channels view of the segment PCM, no copy
+    '''
+    return np.frombuffer(sound.raw_data, dtype=SAMPLE_TYPES[sound.sample_width]).reshape(-1, sound.channels)
+
+
+def read_wav_samples(path: str) -> (np.ndarray, int):
+    '''
+        frames x channels int array of a WAV file and its frame rate
+    '''
+    with wave.open(path, 'rb') as w:
+        frame_rate, channels, width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+        data = w.readframes(w.getnframes())
+    samples = np.frombuffer(data, dtype=SAMPLE_TYPES[width]).reshape(-1, channels)
+    if width == 1:
+        # 8-bit WAV is unsigned
+        samples = (samples.view(np.uint8).astype(np.int16) - 128).astype(np.int8)
+    return samples, frame_rate
+
+
+def segment_sums(values: np.ndarray, starts: np.ndarray, ends: np.ndarray, ufunc=np.add) -> np.ndarray:
+    '''
+        ufunc.reduce over values[starts[i]:ends[i]] for all i at once.
+        Ranges must be non-empty, sorted and non-overlapping
+    '''
+    bounds = np.empty(2*len(starts), dtype=np.int64)
+    bounds[0::2], bounds[1::2] = starts, ends
+    tail = bounds[-1] >= len(values)
+    if tail:
+        bounds = bounds[:-1]
+    return ufunc.reduceat(values, bounds)[0::2]
+
+
+def level_maps(sound: AudioSegment, silence_thresh: int = -50, trim_margin: int = -1) -> dict:
+    '''
+        Book-wide arrays chunk_levels works on: mono float samples and, with
+        trim_margin >= 0, the nearest loud ENVELOPE_MS frame around every frame.
+        Computed once, they let chunk_levels handle ranges a few at a time
+    '''
+    full_scale = float(1 << (8*sound.sample_width - 1))
+    maps = {'full_scale': full_scale, 'ms_frames': sound.frame_rate / 1000,
+            'mono': pcm_array(sound).mean(axis=1, dtype=np.float32) / full_scale}
+    if trim_margin >= 0:
+        mono = maps['mono']
+        step = int(ENVELOPE_MS * maps['ms_frames'])
+        count = len(mono) // step
+        power = np.square(mono[:count*step]).reshape(count, step).mean(axis=1)
+        loud = 10*np.log10(np.maximum(power, 1e-12)) > silence_thresh
+        idx = np.arange(count)
+        # first loud envelope frame at or after i, last loud at or before i
+        maps['next_loud'] = np.minimum.accumulate(np.where(loud, idx, count)[::-1])[::-1]
+        maps['prev_loud'] = np.maximum.accumulate(np.where(loud, idx, -1))
+    return maps
+
+
+def chunk_levels(sound: AudioSegment, ranges: list, silence_thresh: int = -50, trim_margin: int = -1,
+                 mode: str = 'peak', target_dbfs: float = -1.0, maps: dict = None) -> (list, np.ndarray, np.ndarray):
+    '''
+        For all chunk ranges (ms) of sound at once: edge silence trimmed to
+        trim_margin ms (negative keeps the ranges), DC offset and the gain
+        that brings peak or rms level of the chunk to target_dbfs.
+        maps: level_maps of the same sound and settings, computed if not given.
+        Returns (ranges, dc per chunk, gain per chunk)
+    '''
+    if len(ranges) == 0:
+        return [], np.zeros(0), np.zeros(0)
+    if maps is None:
+        maps = level_maps(sound, silence_thresh, trim_margin)
+    full_scale, ms_frames, mono = maps['full_scale'], maps['ms_frames'], maps['mono']
+    bounds = np.array(ranges, dtype=np.int64)
+
+    if trim_margin >= 0:
+        next_loud, prev_loud = maps['next_loud'], maps['prev_loud']
+        count = len(next_loud)
+        first = next_loud[np.minimum(bounds[:, 0] // ENVELOPE_MS, count - 1)]
+        last = prev_loud[np.minimum((bounds[:, 1] - 1) // ENVELOPE_MS, count - 1)]
+        voiced = (first < count) & (last >= 0) & (first <= last)
+        starts = np.maximum(bounds[:, 0], first*ENVELOPE_MS - trim_margin)
+        ends = np.minimum(bounds[:, 1], (last + 1)*ENVELOPE_MS + trim_margin)
+        bounds = np.where(voiced[:, None], np.stack([starts, ends], axis=1), bounds)
+
+    starts = np.minimum((bounds[:, 0] * ms_frames).astype(np.int64), len(mono) - 1)
+    ends = np.maximum(np.minimum((bounds[:, 1] * ms_frames).astype(np.int64), len(mono)), starts + 1)
+    lengths = ends - starts
+    # only the span of the ranges is read, a single chunk costs its own length
+    first, last = starts.min(), ends.max()
+    mono, starts, ends = mono[first:last], starts - first, ends - first
+    dc = segment_sums(mono, starts, ends) / lengths
+    if mode == 'rms':
+        level = np.sqrt(np.maximum(segment_sums(np.square(mono), starts, ends) / lengths - dc**2, 1e-12))
+    else:
+        level = np.maximum(segment_sums(np.abs(mono), starts, ends, np.maximum), 1e-6)
+    gain = 10 ** (target_dbfs / 20) / level
+    # never push the peak over full scale
+    peak = segment_sums(np.abs(mono), starts, ends, np.maximum) + np.abs(dc)
+    gain = np.minimum(gain, 0.999 / np.maximum(peak, 1e-6))
+    return bounds.tolist(), dc * full_scale, gain
+
+
+def chunk_leveler(sound: AudioSegment, silence_thresh: int = -50, trim_margin: int = -1,
+                  normalize: str = None, target_dbfs: float = -1.0):
+    '''
+        None if neither normalize nor trim_margin >= 0, otherwise a function
+        range -> (trimmed range, dc, gain) for one chunk at a time; dc and
+        gain are None without normalize
+    '''
+    if not normalize and trim_margin < 0:
+        return None
+    maps = level_maps(sound, silence_thresh, trim_margin)
+
+    def levels(chunk_range: list) -> (list, float, float):
+        (chunk_range,), dc, gain = chunk_levels(sound, [chunk_range], silence_thresh, trim_margin,
+                                                normalize or 'peak', target_dbfs, maps)
+        return (chunk_range, dc[0], gain[0]) if normalize else (chunk_range, None, None)
+    return levels
+
+
+def apply_levels(chunk: AudioSegment, dc: float, gain: float) -> AudioSegment:
+    samples = pcm_array(chunk).astype(np.float32)
+    samples -= dc
+    samples *= gain
+    info = np.iinfo(SAMPLE_TYPES[chunk.sample_width])
+    data = np.clip(samples, info.min, info.max).astype(info.dtype)
+    return chunk._spawn(data.tobytes())
@@ -0,0 +1,458 @@
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+from utils import split_audio_by_pauses, is_path_to_audio, speech_recognize, \
+                  StringComparison, text_difference, log, file_hash, read_text, safe_audiosegment, export_chunk, \
+                  iter_chunks
+from normalize import chunk_leveler
+from timings import is_path_to_timings, read_intervals
+from checkpoint import Checkpoint
+from chunk_store import ChunkStore
+from clustering import SpeakerClusters
+from recognition import read_payload, RecognitionScheduler, RecognitionFailed, RECOGNITION_RATE
+from profiling import Profiler
+
+
+class Cancelled(Exception):
+    pass
+
+
+DONE = None
+REJECTED_DIR = 'rejected'
+
+
+def save_sample(outdir: str, sample_name: str, output: str, diff: list) -> None:
+    '''
+        The diff is written before the text: a .txt marks the sample as done
+    '''
+    os.makedirs(f'{outdir}/diff', exist_ok=True)
+
+    with open(f'{outdir}/diff/{sample_name}.txt.part', 'w', encoding='utf-8') as text:
+        text.write('\n'.join(diff))
+    os.replace(f'{outdir}/diff/{sample_name}.txt.part', f'{outdir}/diff/{sample_name}.txt')
+
+    with open(f'{outdir}/{sample_name}.txt.part', 'w', encoding='utf-8') as text:
+        text.write(output)
+    os.replace(f'{outdir}/{sample_name}.txt.part', f'{outdir}/{sample_name}.txt')
+
+
+def reject_sample(outdir: str, sample: str, store: ChunkStore = None) -> None:
+    '''
+        Moves a sample below min_accuracy aside (outdir/rejected or the
+        ChunkStore rejected list) with its text and diff removed, so that
+        realign can bring it back
+    '''
+    sample_name = sample.rsplit('.', 1)[0]
+    for path in [f'{outdir}/{sample_name}.txt', f'{outdir}/diff/{sample_name}.txt']:
+        if os.path.isfile(path):
+            os.remove(path)
+    if store is not None and sample in store:
+        store.reject(sample)
+    elif os.path.isfile(f'{outdir}/{sample}'):
+        os.makedirs(f'{outdir}/{REJECTED_DIR}', exist_ok=True)
+        os.replace(f'{outdir}/{sample}', f'{outdir}/{REJECTED_DIR}/{sample}')
+
+
+def restore_sample(outdir: str, sample: str, store: ChunkStore = None) -> None:
+    if store is not None and sample in store.rejected:
+        store.restore(sample)
+    elif os.path.isfile(f'{outdir}/{REJECTED_DIR}/{sample}'):
+        os.replace(f'{outdir}/{REJECTED_DIR}/{sample}', f'{outdir}/{sample}')
+
+
+class ProgressTracker:
+    '''
+        Counts done/total items per stage and derives throughput and ETA.
+        callback(stage, done, total, rate, eta) is called on every update.
+    '''
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.RLock()
+        self.started = {}
+        self.elapsed = {}
+        self.done = {}
+        self.total = {}
+
+    def start(self, stage: str, total: int) -> None:
+        with self.lock:
+            self.started[stage] = time.perf_counter()
+            self.elapsed.setdefault(stage, 0.0)
+            self.done[stage] = 0
+            self.total[stage] = total
+            self.emit(stage)
+
+    def resize(self, stage: str, total: int) -> None:
+        with self.lock:
+            self.total[stage] = total
+            self.emit(stage)
+
+    def grow(self, stage: str, count: int = 1) -> None:
+        with self.lock:
+            self.total[stage] += count
+            self.emit(stage)
+
+    def advance(self, stage: str, count: int = 1) -> None:
+        with self.lock:
+            self.done[stage] += count
+            self.emit(stage)
+
+    def finish(self, stage: str) -> None:
+        with self.lock:
+            self.elapsed[stage] += time.perf_counter() - self.started.pop(stage)
+            self.done[stage] = self.total[stage]
+            self.emit(stage)
+
+    def emit(self, stage: str) -> None:
+        if self.callback is None:
+            return
+        with self.lock:
+            done, total = self.done[stage], self.total[stage]
+            spent = self.elapsed[stage]
+            if stage in self.started:
+                spent += time.perf_counter() - self.started[stage]
+        rate = done / spent if spent > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else -1.0
+        self.callback(stage, done, total, rate, eta)
+
+    def summary(self) -> str:
+        return ', '.join(f'{stage} {spent:.1f}s' for stage, spent in self.elapsed.items())
+
+
+class Pipeline:
+    '''
+        Split -> recognize -> align -> write for one audio/text pair.
+        The stages run in their own threads connected by bounded queues, so
+        recognition starts with the first exported chunk; recognize_workers
+        threads talk to the recognizer, at most max_in_flight of them at once
+        and requests_per_sec requests a second (0 - no limit). The recognizer
+        gets mono payloads at recognition_rate Hz, the samples keep sampling_rate.
+        Transient recognizer errors are retried recognize_retries times;
+        chunks still failing, or rejected by the recognizer, are journaled
+        and kept for the next run.
+        Raw recognizer output, accuracy and position of every chunk stay in
+        the checkpoint and rejected chunks are moved aside for realign.py.
+        cancelled() is polled between chunks; the outdir only ever holds complete samples.
+        Progress is journaled in outdir/checkpoint.jsonl, a restarted run resumes
+        at the first incomplete stage and chunk.
+        With a TextGrid/SRT/VTT instead of a text the audio is cut at its
+        intervals and their texts are written as is, see timed_stage.
+    '''
+    def __init__(self, audioPath: str, txtPath: str, outdirPath: str,
+                 min_sec: int = 3, max_sec: int = 25, min_accuracy: int = 0,
+                 sampling_rate: int = 22050, min_silence_len: int = 800, keep_silence: int = 400,
+                 silence_thresh: int = -50, begin: float = -1, end: float = -1,
+                 progress=None, cancelled=None, recognize=speech_recognize, profile: bool = False,
+                 recognize_workers: int = 4, queue_size: int = 16, chunk_store: bool = False,
+                 normalize: str = None, target_dbfs: float = -1.0, trim_margin: int = -1, audio_cache=None,
+                 cluster_speakers: bool = False, cluster_threshold: float = 0.7, segmentation: str = 'pauses',
+                 recognition_rate: int = RECOGNITION_RATE, requests_per_sec: float = 0, recognize_retries: int = 4,
+                 recognize_backoff: float = 1.0, max_in_flight: int = 0):
+        self.audioPath = audioPath
+        self.txtPath = txtPath
+        self.outdirPath = outdirPath
+        self.min_sec = min_sec
+        self.max_sec = max_sec
+        self.min_accuracy = min_accuracy
+        self.sampling_rate = sampling_rate
+        self.min_silence_len = min_silence_len
+        self.keep_silence = keep_silence
+        self.silence_thresh = silence_thresh
+        self.begin = begin
+        self.end = end
+        self.tracker = ProgressTracker(progress)
+        self.cancelled = cancelled if cancelled is not None else (lambda: False)
+        self.recognize = RecognitionScheduler(recognize, requests_per_sec, max_in_flight=max_in_flight,
+                                              retries=recognize_retries, backoff=recognize_backoff)
+        self.profile = profile
+        self.profiler = Profiler()
+        self.recognize_workers = max(recognize_workers, 1)
+        self.queue_size = queue_size
+        self.chunk_store = chunk_store
+        self.normalize = normalize
+        self.target_dbfs = target_dbfs
+        self.trim_margin = trim_margin
+        self.audio_cache = audio_cache
+        self.cluster_speakers = cluster_speakers
+        self.cluster_threshold = cluster_threshold
+        self.segmentation = segmentation
+        self.recognition_rate = recognition_rate
+        self.source_hash = None
+        self.checkpoint = None
+        self.store = None
+
+        self.stop = threading.Event()
+        self.errors = []
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.live_recognizers = 0
+        self.recognize_queue = None
+        self.align_queue = None
+        self.write_queue = None
+
+    def split_params(self) -> dict:
+        return {'min_sec': self.min_sec, 'max_sec': self.max_sec, 'sampling_rate': self.sampling_rate,
+                'min_silence_len': self.min_silence_len, 'keep_silence': self.keep_silence,
+                'silence_thresh': self.silence_thresh, 'begin': self.begin, 'end': self.end,
+                'normalize': self.normalize, 'target_dbfs': self.target_dbfs, 'trim_margin': self.trim_margin,
+                'segmentation': self.segmentation}
+
+    def open_checkpoint(self) -> None:
+        if not os.path.isdir(self.outdirPath):
+            os.mkdir(self.outdirPath)
+        self.checkpoint = Checkpoint(self.outdirPath)
+        with self.profiler.span('hash source'):
+            self.source_hash = file_hash(self.audioPath)
+        if self.checkpoint.open(self.source_hash, self.split_params()):
+            log(f'Resuming from {self.checkpoint.path}')
+        if self.chunk_store or ChunkStore.exists(self.outdirPath):
+            self.store = ChunkStore(self.outdirPath)
+
+    def check(self) -> None:
+        if self.stop.is_set() or self.cancelled():
+            raise Cancelled()
+
+    def run(self) -> bool:
+        '''
+            Returns False if the run was cancelled.
+            With profile=True a timing report and a Chrome trace are saved to outdir/profile
+        '''
+        self.profiler.reset(self.profile)
+        try:
+            with self.profiler.bound(), self.profiler.span('run'):
+                self.open_checkpoint()
+                self.run_stages()
+        except Cancelled:
+            log(f'Processing cancelled; {self.tracker.summary()}')
+            return False
+        finally:
+            if self.profile:
+                self.profiler.save(f'{self.outdirPath}/profile', datetime.now().strftime('%Y%m%d_%H%M%S'))
+        log(f'Processing finished; {self.tracker.summary()}')
+        if self.checkpoint.failed:
+            log(f'{len(self.checkpoint.failed)} chunks are not recognized, run again to retry them')
+        return True
+
+    def run_stages(self) -> None:
+        if is_path_to_timings(self.txtPath):
+            self.timed_stage()
+            self.checkpoint.set_stage('done')
+            return
+        self.stop.clear()
+        self.errors = []
+        self.queued = set()
+        self.live_recognizers = self.recognize_workers
+        self.recognize_queue = queue.Queue(self.queue_size)
+        self.align_queue = queue.Queue(self.queue_size)
+        self.write_queue = queue.Queue(self.queue_size)
+        for stage in ['recognize', 'align', 'write']:
+            self.tracker.start(stage, 0)
+
+        targets = [('split', self.split_stage), ('align', self.align_stage), ('write', self.write_stage)]
+        targets += [(f'recognize-{i}', self.recognize_stage) for i in range(self.recognize_workers)]
+        threads = [threading.Thread(target=self.stage, args=(target,), name=name) for name, target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+        self.check()
+        for stage in ['recognize', 'align', 'write']:
+            self.tracker.finish(stage)
+        self.checkpoint.set_stage('done')
+
+    def stage(self, target) -> None:
+        try:
+            with self.profiler.bound():
+                target()
+        except Cancelled:
+            self.stop.set()
+        except Exception as ex:
+            self.errors.append(ex)
+            self.stop.set()
+
+    def put(self, q: queue.Queue, item) -> None:
+        while True:
+            self.check()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, q: queue.Queue):
+        while True:
+            self.check()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def enqueue(self, sample: str) -> None:
+        with self.lock:
+            if sample in self.queued:
+                return
+            self.queued.add(sample)
+        for stage in ['recognize', 'align', 'write']:
+            self.tracker.grow(stage)
+        self.put(self.recognize_queue, sample)
+
+    def remove_sample(self, sample: str) -> None:
+        if self.store is not None and sample in self.store:
+            self.store.remove(sample)
+        elif os.path.isfile(f'{self.outdirPath}/{sample}'):
+            os.remove(f'{self.outdirPath}/{sample}')
+
+    def split_stage(self) -> None:
+        outdir = self.outdirPath
+        samples = set(self.store.names()) if self.store is not None else set()
+        samples.update(sample for sample in os.listdir(outdir) if is_path_to_audio(sample))
+        for sample in sorted(samples):
+            if not os.path.isfile(f'{outdir}/{sample.rsplit(".", 1)[0]}.txt'):
+                self.enqueue(sample)
+
+        if self.checkpoint.split_done():
+            log('Audio is already split')
+        else:
+            split_audio_by_pauses(self.audioPath, outdir, self.min_sec, self.max_sec,
+                                  min_silence_len=self.min_silence_len, silence_thresh=self.silence_thresh,
+                                  keep_silence=self.keep_silence, framerate=self.sampling_rate,
+                                  begin=self.begin, end=self.end,
+                                  tracker=self.tracker, cancelled=lambda: self.stop.is_set() or self.cancelled(),
+                                  checkpoint=self.checkpoint, store=self.store,
+                                  normalize=self.normalize, target_dbfs=self.target_dbfs, trim_margin=self.trim_margin,
+                                  cache=self.audio_cache, source_hash=self.source_hash, segmentation=self.segmentation,
+                                  on_chunk=lambda path: self.enqueue(os.path.basename(path)))
+            self.check()
+            self.checkpoint.set_stage('split')
+
+        if self.cluster_speakers and 'cluster' not in self.checkpoint.stages:
+            names = [name for _, name in sorted(self.checkpoint.split.items()) if name is not None]
+            with self.profiler.span('cluster'):
+                clustered = SpeakerClusters(outdir).cluster(outdir, names, self.store, self.cluster_threshold,
+                                                            tracker=self.tracker,
+                                                            cancelled=lambda: self.stop.is_set() or self.cancelled())
+            self.check()
+            if clustered:
+                self.checkpoint.set_stage('cluster')
+
+        for _ in range(self.recognize_workers):
+            self.put(self.recognize_queue, DONE)
+
+    def recognize_stage(self) -> None:
+        outdir = self.outdirPath
+        while True:
+            sample = self.get(self.recognize_queue)
+            if sample is DONE:
+                break
+            if sample in self.checkpoint.recognized:
+                self.profiler.count('journaled recognitions')
+                result = self.checkpoint.recognized[sample]
+            else:
+                with self.profiler.span('read chunk'):
+                    payload = read_payload(outdir, sample, self.store, self.recognition_rate)
+                try:
+                    result = self.recognize(payload, self.check) if payload is not None else ''
+                except RecognitionFailed as ex:
+                    log(f'{sample} is not recognized: {ex}')
+                    self.checkpoint.set_failed(sample, str(ex))
+                    self.tracker.advance('recognize')
+                    continue
+                self.checkpoint.set_recognized(sample, result)
+                if len(result) == 0:
+                    self.remove_sample(sample)
+            self.tracker.advance('recognize')
+            if len(result) > 0:
+                self.put(self.align_queue, (sample, ' '.join(result.splitlines())))
+
+        with self.lock:
+            self.live_recognizers -= 1
+            last = self.live_recognizers == 0
+        if last:
+            self.put(self.align_queue, DONE)
+
+    def align_stage(self) -> None:
+        outdir = self.outdirPath
+        with self.profiler.span('read text'):
+            original_text = read_text(self.txtPath)
+        sc = StringComparison(original_text)
+        while True:
+            item = self.get(self.align_queue)
+            if item is DONE:
+                break
+            sample, result = item
+            position, rate, output = sc.find(result)
+            self.tracker.advance('align')
+            if self.min_accuracy > rate:
+                self.profiler.count('rejected samples')
+                reject_sample(outdir, sample, self.store)
+                self.checkpoint.set_aligned(sample, rate, position, False)
+                continue
+            self.put(self.write_queue, (sample, rate, position, output, result))
+        self.put(self.write_queue, DONE)
+
+    def write_stage(self) -> None:
+        while True:
+            item = self.get(self.write_queue)
+            if item is DONE:
+                break
+            sample, rate, position, output, result = item
+            with self.profiler.span('write'):
+                self.write_sample(sample.rsplit('.', 1)[0], output, result)
+            self.checkpoint.set_aligned(sample, rate, position, True)
+            self.profiler.count('written samples')
+            self.tracker.advance('write')
+
+    def timed_stage(self) -> None:
+        '''
+            One pass over the intervals of a timing file: no silence detection,
+            recognition or alignment, the interval text is the sample text
+        '''
+        outdir = self.outdirPath
+        begin = max(self.begin, 0)
+        end = self.end if self.end > 0 else -1
+        if end >= 0 and begin > end:
+            begin, end = end, begin
+        intervals = [(start - begin, stop - begin, text) for start, stop, text in read_intervals(self.txtPath)
+                     if start >= begin and (end < 0 or stop <= end)]
+        ranges = [[int(start*1000), int(stop*1000)] for start, stop, _ in intervals]
+        if self.checkpoint.chunks is None:
+            self.checkpoint.set_chunks(ranges)
+        first = self.checkpoint.resume_index()
+        if first >= len(ranges):
+            return
+
+        self.tracker.start('decode', 1)
+        sound = safe_audiosegment(self.audioPath, self.sampling_rate, self.audio_cache, self.source_hash, begin, end)
+        if sound is None:
+            return
+        self.tracker.finish('decode')
+        with self.profiler.span('levels'):
+            levels = chunk_leveler(sound, self.silence_thresh, self.trim_margin, self.normalize, self.target_dbfs)
+
+        self.tracker.start('write', len(ranges))
+        self.tracker.advance('write', first)
+        basename = os.path.basename(self.audioPath.rsplit('.', 1)[0])
+        for i, chunk in iter_chunks(sound, ranges, first, levels):
+            self.check()
+            sample = None
+            if self.max_sec >= chunk.duration_seconds >= self.min_sec:
+                sample = f'{basename}_{str(i+1).zfill(5)}.wav'
+                export_chunk(chunk, f'{outdir}/{sample}', self.store)
+                text = intervals[i][2]
+                with self.profiler.span('write'):
+                    self.write_sample(sample.rsplit('.', 1)[0], text, ' '.join(re.findall(r'\w+', text)))
+                self.checkpoint.set_aligned(sample, 100, i, True)
+                self.profiler.count('written samples')
+            self.checkpoint.set_split(i, sample)
+            self.tracker.advance('write')
+        self.tracker.finish('write')
+        self.checkpoint.set_stage('split')
+
+    def write_sample(self, sample_name: str, output: str, result: str) -> None:
+        save_sample(self.outdirPath, sample_name, output, text_difference(output, result))
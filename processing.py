@@ -0,0 +1,99 @@
+from PyQt5 import QtCore
+from pipeline import Pipeline
+from audio_cache import AudioCache
+from recognition import RECOGNITION_RATE
+from async_recognizer import AsyncRecognizer
+from utils import log, speech_recognize
+
+
+class ProcessingThread(QtCore.QThread):
+    finish_signal = QtCore.pyqtSignal(object, object, object) # ToDo: Refactoring
+    progress_signal = QtCore.pyqtSignal(str, int, int, float, float)
+
+    def __init__(self, parent=None):
+        QtCore.QThread.__init__(self, parent)
+
+        self.audioPath:str
+        self.outdirPath:str
+        self.txtPath:str
+        self.min_sec:int
+        self.max_sec:int
+        self.min_accuracy:int
+        self.sampling_rate:int
+        self.min_silence_len:int
+        self.keep_silence:int
+        self.silence_thresh:int
+        self.begin:float = -1
+        self.end:float = -1
+        self.profile:bool = False
+        self.recognize_workers:int = 4
+        self.chunk_store:bool = False
+        self.normalize:str = None
+        self.target_dbfs:float = -1.0
+        self.trim_margin:int = -1
+        self.audio_cache:AudioCache = None
+        self.cluster_speakers:bool = False
+        self.cluster_threshold:float = 0.7
+        self.segmentation:str = 'pauses'
+        self.recognition_rate:int = RECOGNITION_RATE
+        self.requests_per_sec:float = 0
+        self.recognize_retries:int = 4
+        self.recognize_connections:int = 0
+        self.max_in_flight:int = 0
+
+    def setParams(self, params: dict) -> None:
+        self.min_sec = params['min_sample_len sec']
+        self.max_sec = params['max_sample_len sec']
+        self.min_accuracy = params['min_accuracy %']
+        self.sampling_rate = params['sampling_rate']
+        self.min_silence_len = params['min_silence_len ms']
+        self.keep_silence = params['keep_silence ms']
+        self.silence_thresh = params['silence_threshold db']
+        self.profile = params.get('profile', False)
+        self.recognize_workers = params.get('recognize_workers', 4)
+        self.chunk_store = params.get('chunk_store', False)
+        self.normalize = params.get('normalize', None)
+        self.target_dbfs = params.get('target_dbfs', -1.0)
+        self.trim_margin = params.get('trim_margin ms', -1)
+        cache_mb = params.get('audio_cache_mb', 2048)
+        self.audio_cache = AudioCache(params.get('audio_cache_dir', AudioCache.DIR), cache_mb) if cache_mb > 0 else None
+        self.cluster_speakers = params.get('cluster_speakers', False)
+        self.cluster_threshold = params.get('cluster_threshold', 0.7)
+        self.segmentation = params.get('segmentation', 'pauses')
+        self.recognition_rate = params.get('recognition_rate', RECOGNITION_RATE)
+        self.requests_per_sec = params.get('requests_per_sec', 0)
+        self.recognize_retries = params.get('recognize_retries', 4)
+        self.recognize_connections = params.get('recognize_connections', 0)
+        self.max_in_flight = params.get('max_in_flight', 0)
+        self.begin = -1
+        self.end = -1
+
+    def run(self):
+        client, pipeline = None, None
+        try:
+            # pooled keep-alive connections instead of a new one per chunk
+            if self.recognize_connections > 0:
+                client = AsyncRecognizer(connections=self.recognize_connections)
+            pipeline = Pipeline(self.audioPath, self.txtPath, self.outdirPath,
+                                min_sec=self.min_sec, max_sec=self.max_sec, min_accuracy=self.min_accuracy,
+                                sampling_rate=self.sampling_rate, min_silence_len=self.min_silence_len,
+                                keep_silence=self.keep_silence, silence_thresh=self.silence_thresh,
+                                begin=self.begin, end=self.end, profile=self.profile,
+                                recognize_workers=self.recognize_workers, chunk_store=self.chunk_store,
+                                normalize=self.normalize, target_dbfs=self.target_dbfs, trim_margin=self.trim_margin,
+                                audio_cache=self.audio_cache, cluster_speakers=self.cluster_speakers,
+                                cluster_threshold=self.cluster_threshold, segmentation=self.segmentation,
+                                recognition_rate=self.recognition_rate, requests_per_sec=self.requests_per_sec,
+                                recognize_retries=self.recognize_retries, max_in_flight=self.max_in_flight,
+                                recognize=client if client is not None else speech_recognize,
+                                progress=self.progress_signal.emit, cancelled=self.isInterruptionRequested)
+            completed = pipeline.run()
+        except Exception as ex:
+            log(f'Processing failed: {ex!r}')
+            self.finish_signal.emit(False, pipeline.tracker.summary() if pipeline is not None else '', ex)
+            return
+        finally:
+            if client is not None:
+                client.close()
+
+        self.finish_signal.emit(completed, pipeline.tracker.summary(), None)
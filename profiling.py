@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Profiler:
+    '''
+        Named spans and counters for one processing run.
+        Disabled by default: span() and count() then cost one attribute check.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = defaultdict(int)
+
+    def reset(self, enabled: bool = True) -> None:
+        with self.lock:
+            self.enabled = enabled
+            self.origin = time.perf_counter()
+            self.spans = []
+            self.counters = defaultdict(int)
+
+    @contextmanager
+    def span(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stop = time.perf_counter()
+            with self.lock:
+                self.spans.append((name, threading.get_ident(), start - self.origin, stop - start))
+
+    def timed(self, name: str):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] += value
+
+    def report(self) -> dict:
+        timers = {}
+        with self.lock:
+            for name, _, _, duration in self.spans:
+                timer = timers.setdefault(name, {'calls': 0, 'total_sec': 0.0, 'max_sec': 0.0})
+                timer['calls'] += 1
+                timer['total_sec'] += duration
+                timer['max_sec'] = max(timer['max_sec'], duration)
+            counters = dict(self.counters)
+        for timer in timers.values():
+            timer['mean_sec'] = timer['total_sec'] / timer['calls']
+        return {'timers': timers, 'counters': counters}
+
+    def chrome_trace(self) -> dict:
+        '''
+            Trace Event Format, loadable in chrome://tracing or Perfetto
+        '''
+        pid = os.getpid()
+        with self.lock:
+            events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                       'ts': int(start * 1e6), 'dur': int(duration * 1e6)}
+                      for name, tid, start, duration in self.spans]
+            events += [{'name': name, 'ph': 'C', 'pid': pid, 'ts': 0, 'args': {name: value}}
+                       for name, value in self.counters.items()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, outdir: str, prefix: str) -> None:
+        os.makedirs(outdir, exist_ok=True)
+        with open(f'{outdir}/{prefix}.json', 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=1)
+        with open(f'{outdir}/{prefix}.trace.json', 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+    @contextmanager
+    def bound(self):
+        '''
+            Makes `profiler` record to this instance in the current thread
+        '''
+        previous = getattr(_bound, 'profiler', None)
+        _bound.profiler = self
+        try:
+            yield self
+        finally:
+            _bound.profiler = previous
+
+
+class ThreadProfiler:
+    '''
+        Records to the Profiler bound to the calling thread and drops
+        everything in threads without one, so runs going on at the same
+        time (batch jobs) keep separate reports
+    '''
+    def current(self) -> Profiler:
+        return getattr(_bound, 'profiler', None) or _unbound
+
+    def span(self, name: str):
+        return self.current().span(name)
+
+    def timed(self, name: str):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.current().count(name, value)
+
+
+_bound = threading.local()
+_unbound = Profiler()
+profiler = ThreadProfiler()
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from checkpoint import Checkpoint
+from chunk_store import ChunkStore
+from pipeline import save_sample, reject_sample, restore_sample, REJECTED_DIR
+from utils import StringComparison, text_difference, read_text, log
+
+_comparison = None
+
+
+def load_text(txtPath: str) -> None:
+    global _comparison
+    _comparison = StringComparison(read_text(txtPath))
+
+
+def align(item: tuple) -> tuple:
+    sample, result = item
+    position, rate, output = _comparison.find(result)
+    return sample, position, rate, output, text_difference(output, result)
+
+
+def located(outdir: str, sample: str, store: ChunkStore = None) -> bool:
+    if store is not None and (sample in store or sample in store.rejected):
+        return True
+    return os.path.isfile(f'{outdir}/{sample}') or os.path.isfile(f'{outdir}/{REJECTED_DIR}/{sample}')
+
+
+def realign(outdir: str, txtPath: str, min_accuracy: int = 0, workers: int = None) -> (int, int):
+    '''
+        Aligns the recognizer output journaled in the checkpoint of outdir
+        against txtPath again, no audio is decoded or recognized. Samples
+        get new texts and diffs; the ones below min_accuracy are moved aside
+        and earlier rejected ones that pass now are brought back. Samples
+        already confirmed (moved to correct/) are left alone.
+        Returns the numbers of written and rejected samples
+    '''
+    checkpoint = Checkpoint(outdir)
+    if checkpoint.read() is None:
+        raise ValueError(f'No checkpoint in {outdir}')
+    store = ChunkStore(outdir) if ChunkStore.exists(outdir) else None
+    items = [(sample, ' '.join(text.splitlines())) for sample, text in sorted(checkpoint.recognized.items())
+             if text and located(outdir, sample, store)]
+    log(f'Realigning {len(items)} samples')
+
+    written = rejected = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_text, initargs=(txtPath,)) as executor:
+        for sample, position, rate, output, diff in executor.map(align, items, chunksize=16):
+            if min_accuracy > rate:
+                reject_sample(outdir, sample, store)
+                rejected += 1
+            else:
+                restore_sample(outdir, sample, store)
+                save_sample(outdir, sample.rsplit('.', 1)[0], output, diff)
+                written += 1
+            checkpoint.set_aligned(sample, rate, position, min_accuracy <= rate)
+    return written, rejected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Align the journaled recognizer output of an outdir against a text again')
+    parser.add_argument('outdir', help='outdir of a processed book')
+    parser.add_argument('text', help='book text')
+    parser.add_argument('--params', default='params.json', help='min_accuracy is read from it')
+    parser.add_argument('--min-accuracy', type=int, default=None, help='%%, params.json value by default')
+    parser.add_argument('--workers', type=int, default=None, help='parallel aligners')
+    args = parser.parse_args()
+
+    params = {}
+    if os.path.isfile(args.params):
+        with open(args.params, 'r') as params_json:
+            params = json.load(params_json)
+    min_accuracy = args.min_accuracy if args.min_accuracy is not None else params.get('min_accuracy %', 0)
+    written, rejected = realign(args.outdir, args.text, min_accuracy, args.workers)
+    log(f'Realigned: {written} written, {rejected} rejected')
@@ -0,0 +1,172 @@
+import os
+import random
+import threading
+import time
+import wave
+from contextlib import nullcontext
+import numpy as np
+import speech_recognition
+
+from normalize import read_wav_samples
+from resample import resample_array
+from profiling import profiler
+
+RECOGNITION_RATE = 16000
+WAIT_SLICE = 0.1
+
+
+class TransientRecognitionError(Exception):
+    '''
+        The recognizer could not answer (network, timeout, quota); the audio is fine
+    '''
+
+
+class PermanentRecognitionError(Exception):
+    '''
+        The recognizer rejected the request (bad request, key, permissions); repeating it is useless
+    '''
+
+
+def transient_status(status: int) -> bool:
+    '''
+        HTTP statuses of the recognizer worth repeating a request for: quota and server errors
+    '''
+    return status == 429 or status >= 500
+
+
+class RecognitionFailed(Exception):
+    '''
+        A sample is still unrecognized after all retries
+    '''
+
+
+class RecognitionPayload(speech_recognition.AudioData):
+    '''
+        16-bit mono AudioData of one sample as it is sent to the recognizer,
+        built once per sample and reused if the request is repeated. The FLAC
+        encoding (a flac subprocess) is kept too, so a retry sends it as is
+    '''
+    def __init__(self, name: str, frame_data: bytes, sample_rate: int):
+        super().__init__(frame_data, sample_rate, 2)
+        self.name = name
+        self.flac = {}
+
+    def get_flac_data(self, convert_rate: int = None, convert_width: int = None) -> bytes:
+        key = (convert_rate, convert_width)
+        if key not in self.flac:
+            self.flac[key] = super().get_flac_data(convert_rate, convert_width)
+        return self.flac[key]
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    '''
+        frames x channels int array -> mono float32 in 16-bit scale
+    '''
+    scale = 2 ** (16 - 8 * samples.dtype.itemsize)
+    mono = samples.mean(axis=1, dtype=np.float32)
+    return mono * scale if scale != 1 else mono
+
+
+def recognition_payload(name: str, samples: np.ndarray, frame_rate: int,
+                        rate: int = RECOGNITION_RATE) -> RecognitionPayload:
+    '''
+        Downmixes and resamples a chunk for recognition. Chunks already at or
+        below rate are not upsampled; rate <= 0 keeps the chunk rate
+    '''
+    mono = downmix(samples)
+    if 0 < rate < frame_rate:
+        mono = resample_array(mono[:, None], frame_rate, rate)[:, 0]
+        frame_rate = rate
+    data = np.clip(np.rint(mono), -32768, 32767).astype(np.int16)
+    return RecognitionPayload(name, data.tobytes(), frame_rate)
+
+
+def read_payload(outdir: str, name: str, store=None, rate: int = RECOGNITION_RATE) -> RecognitionPayload:
+    '''
+        Payload of a sample from the ChunkStore or its outdir WAV file,
+        None if the sample is gone
+    '''
+    try:
+        if store is not None and name in store:
+            samples, frame_rate = store.samples(name), store.index[name]['sample_rate']
+        else:
+            samples, frame_rate = read_wav_samples(os.path.join(outdir, name))
+    except (OSError, KeyError, wave.Error):
+        return None
+    return recognition_payload(name, samples, frame_rate, rate)
+
+
+def pause(seconds: float, check=None) -> None:
+    '''
+        Sleeps in WAIT_SLICE steps, check() may raise to stop waiting
+    '''
+    deadline = time.monotonic() + seconds
+    while True:
+        if check is not None:
+            check()
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(left, WAIT_SLICE))
+
+
+class TokenBucket:
+    '''
+        rate requests per second on average, up to burst at once
+    '''
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, check=None) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            pause(wait, check)
+
+
+class RecognitionScheduler:
+    '''
+        Calls recognize(payload) under a request rate limit (requests_per_sec,
+        0 - none) and a cap of max_in_flight concurrent requests (0 - none).
+        TransientRecognitionError is retried up to retries times with
+        exponential backoff and full jitter; then, or at once on a
+        PermanentRecognitionError, RecognitionFailed is raised and the audio
+        is left for a later run. Any other result, '' for no speech included,
+        is final
+    '''
+    def __init__(self, recognize, requests_per_sec: float = 0, burst: int = 1, max_in_flight: int = 0,
+                 retries: int = 4, backoff: float = 1.0, max_backoff: float = 30.0):
+        self.recognize = recognize
+        self.bucket = TokenBucket(requests_per_sec, burst) if requests_per_sec > 0 else None
+        self.slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def __call__(self, payload, check=None) -> str:
+        for attempt in range(self.retries + 1):
+            if attempt:
+                profiler.count('recognition retries')
+                pause(random.uniform(0, min(self.backoff * 2 ** (attempt - 1), self.max_backoff)), check)
+            if self.bucket is not None:
+                self.bucket.acquire(check)
+            try:
+                with self.slots if self.slots is not None else nullcontext():
+                    return self.recognize(payload)
+            except TransientRecognitionError as ex:
+                error = ex
+            except PermanentRecognitionError as ex:
+                error = ex
+                break
+        profiler.count('recognition failures')
+        raise RecognitionFailed(f'{error}') from error
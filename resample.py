@@ -0,0 +1,90 @@
+from math import gcd
+import numpy as np
+from pydub import AudioSegment
+
+from normalize import pcm_array, SAMPLE_TYPES
+
+TAPS_PER_PHASE = 32
+KAISER_BETA = 8.0
+ROLLOFF = 0.94
+BLOCK_FRAMES = 1 << 16
+
+_filters = {}
+
+
+def polyphase_filter(up: int, down: int) -> np.ndarray:
+    '''
+        Kaiser windowed sinc low-pass for up/down resampling split into
+        up phases: row p holds taps p, p+up, p+2*up, ...
+    '''
+    key = (up, down)
+    if key not in _filters:
+        length = up * TAPS_PER_PHASE
+        odd = length - 1 + length % 2  # odd length keeps the delay a whole number of samples
+        cutoff = ROLLOFF * 0.5 / max(up, down)
+        n = np.arange(odd) - (odd - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(odd, KAISER_BETA) * up
+        taps = np.concatenate([taps, np.zeros(length - odd)])
+        _filters[key] = (taps.reshape(TAPS_PER_PHASE, up).T.astype(np.float32), (odd - 1) // 2)
+    return _filters[key]
+
+
+def resample_array(samples: np.ndarray, src_rate: int, dst_rate: int, block: int = BLOCK_FRAMES,
+                   dtype=None) -> np.ndarray:
+    '''
+        samples: frames x channels array. Output is produced in blocks of
+        about block frames; a block converts only the input span it reads
+        (taps of overlap included) to float32, so besides the input and the
+        output just one block is in memory. With an integer dtype the output
+        is rounded and clipped into it block by block, float32 otherwise.
+        Outputs m, m+up, m+2*up... share a filter phase and read the input
+        with a fixed stride, so each of them is one matrix-vector product
+        over a strided view of the input block
+    '''
+    if src_rate == dst_rate:
+        return samples if dtype is None else samples.astype(dtype)
+    g = gcd(src_rate, dst_rate)
+    up, down = dst_rate // g, src_rate // g
+    phases, delay = polyphase_filter(up, down)
+    taps = phases.shape[1]
+    reversed_phases = np.ascontiguousarray(phases[:, ::-1])
+    info = np.iinfo(dtype) if dtype is not None and np.issubdtype(dtype, np.integer) else None
+
+    frames, channels = samples.shape
+    out_frames = -(-frames * up // down)
+    output = np.empty((out_frames, channels), dtype=dtype or np.float32)
+    per_phase = max(block // up, 1)
+
+    for first in range(0, out_frames, per_phase * up):
+        last = min(first + per_phase * up, out_frames)
+        # input frames lo..hi-1 feed outputs first..last-1, outside the input is silence
+        lo = (first * down + delay) // up - taps + 1
+        hi = ((last - 1) * down + delay) // up + 1
+        window = np.zeros((channels, hi - lo), dtype=np.float32)
+        window[:, max(-lo, 0):min(frames, hi) - lo] = samples[max(lo, 0):min(frames, hi)].T
+        step = window.strides[1]
+        result = np.empty((channels, last - first), dtype=np.float32)
+        for r in range(min(up, last - first)):
+            count = -(-(last - first - r) // up)
+            j = (first + r) * down + delay
+            base, p = j // up - taps + 1 - lo, j % up
+            for c in range(channels):
+                # row t: window[c, base + down*t : base + taps + down*t]
+                rows = np.lib.stride_tricks.as_strided(window[c, base:], shape=(count, taps),
+                                                       strides=(down * step, step), writeable=False)
+                result[c, r::up] = rows @ reversed_phases[p]
+        if info is not None:
+            result = np.clip(np.rint(result), info.min, info.max)
+        output[first:last] = result.T
+    return output
+
+
+def resample_segment(sound: AudioSegment, framerate: int) -> AudioSegment:
+    '''
+        Polyphase replacement for AudioSegment.set_frame_rate; returns sound itself if rates match.
+        The PCM is resampled straight into the output sample type, block by block
+    '''
+    if sound.frame_rate == framerate:
+        return sound
+    data = resample_array(pcm_array(sound), sound.frame_rate, framerate, dtype=SAMPLE_TYPES[sound.sample_width])
+    return sound._spawn(data.tobytes(), overrides={'frame_rate': framerate})
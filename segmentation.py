@@ -0,0 +1,69 @@
+from collections import deque
+
+PAUSE_WEIGHT = 0.05
+
+
+def chunk_pauses(ranges: list, keep_silence: int) -> list:
+    '''
+        Silence between neighbouring detect_chunks ranges, ms. Ranges grown
+        by keep_silence into each other were cut in the middle, for them
+        the result is 2*keep_silence, an upper bound of the real pause
+    '''
+    return [max(nxt[0] - cur[1], 0) + 2*keep_silence for cur, nxt in zip(ranges, ranges[1:])]
+
+
+def select_segments(ranges: list, pauses: list, min_ms: int, max_ms: int,
+                    pause_weight: float = PAUSE_WEIGHT) -> list:
+    '''
+        Merges runs of neighbouring ranges into segments of min_ms..max_ms.
+        Dynamic programming over the ranges picks the segments that keep the
+        most voiced audio (the ranges themselves, not the pauses merged in
+        between); every cut is worth pause_weight * its pause length (ms), so
+        ranges valid on their own stay apart and merges only rescue short
+        ones, and among equal choices the cuts land in longer pauses.
+        best[j] uses ranges[:j]; a segment ranges[i..j] is allowed while
+        e_j - max_ms <= s_i <= e_j - min_ms, a window that only moves right
+        as j grows, so its best start is kept in a monotonic deque: O(n).
+        Returns the segments as [start, end] ms
+    '''
+    n = len(ranges)
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
+    cut = [0.0] + [pause_weight * pause for pause in pauses] + [0.0]  # cut[i]: cut before ranges[i]
+    voiced = [0] * (n + 1)  # voiced[i]: length of ranges[:i]
+    for i, (start, end) in enumerate(ranges):
+        voiced[i + 1] = voiced[i] + end - start
+
+    best = [0.0] * (n + 1)
+    choice = [-1] * (n + 1)
+    window = deque()
+    candidate = lambda i: best[i] - voiced[i] + cut[i]
+    lo = hi = 0
+    for j in range(n):
+        while hi <= j and starts[hi] <= ends[j] - min_ms:
+            while window and candidate(window[-1]) <= candidate(hi):
+                window.pop()
+            window.append(hi)
+            hi += 1
+        while lo < hi and starts[lo] < ends[j] - max_ms:
+            lo += 1
+        while window and window[0] < lo:
+            window.popleft()
+
+        best[j + 1], choice[j + 1] = best[j], -1
+        if window:
+            i = window[0]
+            value = candidate(i) + voiced[j + 1] + cut[j + 1]
+            if value > best[j + 1]:
+                best[j + 1], choice[j + 1] = value, i
+
+    segments = []
+    j = n
+    while j > 0:
+        i = choice[j]
+        if i < 0:
+            j -= 1
+        else:
+            segments.append([starts[i], ends[j - 1]])
+            j = i
+    return segments[::-1]
@@ -0,0 +1,166 @@
+import numpy as np
+from pydub import AudioSegment
+
+from normalize import pcm_array
+
+ENVELOPE_BLOCK_MS = 60000
+DETECT_BLOCK_MS = 600000
+
+
+def energy_envelope(sound: AudioSegment, first: int = 0, last: int = None) -> (np.ndarray, np.ndarray):
+    '''
+        For milliseconds first..last of sound: prefix[i] is the sum of squared
+        samples of milliseconds first..first+i-1, bounds[i] the first frame of
+        millisecond first+i, both as pydub slices them. Window sums of any
+        length are prefix differences, so one pass serves every window
+    '''
+    samples = pcm_array(sound)
+    frames = len(samples)
+    last = len(sound) if last is None else last
+    ms = last - first
+    bounds = (np.arange(first, last + 1, dtype=np.int64) * sound.frame_rate / 1000.0).astype(np.int64)
+    clipped = np.minimum(bounds, frames)
+    # 8/16-bit sums are exact in int64; squares of 32-bit (and 24-bit, padded by pydub) samples
+    # overflow it, those are summed in float64 like audioop.rms does
+    dtype = np.int64 if sound.sample_width <= 2 else np.float64
+    prefix = np.zeros(ms + 1, dtype=dtype)
+    total = 0
+    for lo in range(0, ms, ENVELOPE_BLOCK_MS):
+        hi = min(lo + ENVELOPE_BLOCK_MS, ms)
+        begin, end = clipped[lo], clipped[hi]
+        energy = np.square(samples[begin:end].astype(dtype)).sum(axis=1)
+        cumulative = np.concatenate([[0], np.cumsum(energy)])
+        prefix[lo + 1:hi + 1] = total + cumulative[clipped[lo + 1:hi + 1] - begin]
+        total = prefix[hi]
+    return prefix, bounds
+
+
+def silent_windows(prefix: np.ndarray, bounds: np.ndarray, starts: np.ndarray, channels: int,
+                   threshold: float, min_silence_len: int) -> np.ndarray:
+    '''
+        Mask of the min_silence_len windows at starts (indexes into prefix)
+        whose rms is at or below threshold, audioop.rms rounding included
+    '''
+    sums = prefix[starts + min_silence_len] - prefix[starts]
+    # pydub pads a slice running past the last frame with silence
+    counts = (bounds[starts + min_silence_len] - bounds[starts]) * channels
+    return np.floor(np.sqrt(sums / np.maximum(counts, 1))) <= threshold
+
+
+def window_starts(first: int, last: int, last_start: int, seek_step: int) -> np.ndarray:
+    '''
+        pydub detect_silence window starts in first..last-1: every seek_step
+        ms and the last possible start
+    '''
+    starts = np.arange(first, last, seek_step, dtype=np.int64)
+    if last > last_start and last_start % seek_step:
+        starts = np.append(starts, last_start)
+    return starts
+
+
+def nonsilent_ranges(prefix: np.ndarray, bounds: np.ndarray, channels: int, max_amplitude: float,
+                     min_silence_len: int, silence_thresh: int, seek_step: int) -> np.ndarray:
+    '''
+        pydub detect_nonsilent on the envelope of a whole sound
+    '''
+    length = len(prefix) - 1
+    if length < min_silence_len:
+        return np.array([[0, length]], dtype=np.int64)
+    last_start = length - min_silence_len
+    starts = window_starts(0, last_start + 1, last_start, seek_step)
+    silent = starts[silent_windows(prefix, bounds, starts, channels, 10 ** (silence_thresh / 20) * max_amplitude,
+                                   min_silence_len)]
+    if len(silent) == 0:
+        return np.array([[0, length]], dtype=np.int64)
+
+    steps = np.diff(silent)
+    breaks = np.flatnonzero((steps != seek_step) & (steps > min_silence_len))
+    silence = np.stack([np.append(silent[0], silent[breaks + 1]),
+                        np.append(silent[breaks], silent[-1]) + min_silence_len], axis=1)
+    if silence[0, 0] == 0 and silence[0, 1] == length:
+        return np.zeros((0, 2), dtype=np.int64)
+    ranges = np.stack([np.append(0, silence[:, 1]), np.append(silence[:, 0], length)], axis=1)
+    if silence[-1, 1] == length:
+        ranges = ranges[:-1]
+    if len(ranges) and ranges[0, 0] == 0 and ranges[0, 1] == 0:
+        ranges = ranges[1:]
+    return ranges
+
+
+def chunk_ranges(nonsilent: np.ndarray, keep_silence: int, length: int) -> np.ndarray:
+    '''
+        detect_chunks on nonsilent ranges
+    '''
+    ranges = nonsilent + np.array([-keep_silence, keep_silence])
+    overlap = np.flatnonzero(ranges[1:, 0] < ranges[:-1, 1])
+    middle = (ranges[overlap, 1] + ranges[overlap + 1, 0]) // 2
+    ranges[overlap, 1] = middle
+    ranges[overlap + 1, 0] = middle
+    return np.stack([np.maximum(ranges[:, 0], 0), np.minimum(ranges[:, 1], length)], axis=1)
+
+
+def iter_nonsilent(sound: AudioSegment, min_silence_len: int = 800, silence_thresh: int = -50,
+                   seek_step: int = 1, block_ms: int = DETECT_BLOCK_MS):
+    '''
+        pydub detect_nonsilent ranges (ms) yielded in order as the scan goes:
+        the envelope is built block_ms at a time and a range is yielded as
+        soon as the silence after it ends
+    '''
+    length = len(sound)
+    if length < min_silence_len:
+        yield [0, length]
+        return
+    last_start = length - min_silence_len
+    threshold = 10 ** (silence_thresh / 20) * sound.max_possible_amplitude
+    block = max(block_ms // seek_step, 1) * seek_step
+    run = None  # [first, last] window start of the silence still going on
+    previous_end = 0
+    found = False
+    for first in range(0, last_start + 1, block):
+        starts = window_starts(first, min(first + block, last_start + 1), last_start, seek_step)
+        prefix, bounds = energy_envelope(sound, first, int(starts[-1]) + min_silence_len)
+        silent = starts[silent_windows(prefix, bounds, starts - first, sound.channels, threshold, min_silence_len)]
+        if len(silent) == 0:
+            continue
+        if run is not None:
+            silent = np.append(run[1], silent)
+        steps = np.diff(silent)
+        breaks = np.flatnonzero((steps != seek_step) & (steps > min_silence_len))
+        run_starts = np.append(silent[0] if run is None else run[0], silent[breaks + 1]).tolist()
+        run_ends = np.append(silent[breaks], silent[-1]).tolist()
+        # all runs but the last one are complete
+        for start, end in zip(run_starts[:-1], run_ends[:-1]):
+            if start > 0 or previous_end > 0:
+                yield [previous_end, start]
+            previous_end = end + min_silence_len
+        run = [run_starts[-1], run_ends[-1]]
+        found = True
+
+    if not found:
+        yield [0, length]
+        return
+    start, end = run[0], run[1] + min_silence_len
+    if start > 0 or previous_end > 0:
+        yield [previous_end, start]
+    if end < length:
+        yield [end, length]
+
+
+def iter_chunk_ranges(sound: AudioSegment, min_silence_len: int = 800, silence_thresh: int = -50,
+                      keep_silence: int = 400, seek_step: int = 1):
+    '''
+        detect_chunks ranges (ms) yielded one by one; a range is complete once
+        the next nonsilent range is known, they may overlap into each other
+    '''
+    length = len(sound)
+    previous = None
+    for start, end in iter_nonsilent(sound, min_silence_len, silence_thresh, seek_step):
+        current = [start - keep_silence, end + keep_silence]
+        if previous is not None:
+            if current[0] < previous[1]:
+                previous[1] = (previous[1] + current[0]) // 2
+                current[0] = previous[1]
+            yield [max(previous[0], 0), min(previous[1], length)]
+        previous = current
+    if previous is not None:
+        yield [max(previous[0], 0), min(previous[1], length)]
@@ -0,0 +1,147 @@
+import json
+import os
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from pydub.utils import mediainfo
+
+from utils import log
+
+
+class SpeakerRegistry:
+    '''
+        Speakers of an outdir and statistics of their confirmed samples,
+        kept in outdir/correct/speakers.jsonl. Every line is one event:
+            {"speaker"}                                   - speaker added
+            {"speaker", "removed": true}                  - speaker removed from the list
+            {"speaker", "sample", "duration", "accuracy"} - sample confirmed, duration in sec
+        Totals are updated in memory as events come, queries never walk the tree.
+        Samples confirmed without a speaker are counted under ''.
+    '''
+    FILE = 'speakers.jsonl'
+
+    def __init__(self, outdir: str):
+        self.correctDir = f'{outdir}/correct'
+        self.path = f'{self.correctDir}/{self.FILE}'
+        self.clear()
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.replay(event)
+
+    def clear(self) -> None:
+        self.listed = {}
+        self.stats = {}
+        self.samples = {}
+
+    def replay(self, event: dict) -> None:
+        speaker = event['speaker']
+        if event.get('removed'):
+            self.listed.pop(speaker, None)
+            return
+        self.listed[speaker] = True
+        if 'sample' not in event or event['sample'] in self.samples:
+            return
+        self.samples[event['sample']] = speaker
+        stats = self.stats.setdefault(speaker, {'samples': 0, 'duration': 0.0, 'accuracy_sum': 0.0, 'rated': 0})
+        stats['samples'] += 1
+        stats['duration'] += event['duration']
+        if event.get('accuracy') is not None:
+            stats['accuracy_sum'] += event['accuracy']
+            stats['rated'] += 1
+
+    def journal(self, event: dict) -> None:
+        os.makedirs(self.correctDir, exist_ok=True)
+        self.replay(event)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def add(self, speaker: str) -> None:
+        if speaker not in self.listed:
+            self.journal({'speaker': speaker})
+
+    def remove(self, speaker: str) -> None:
+        '''
+            Hides the speaker from the list, statistics of its samples stay
+        '''
+        if speaker in self.listed:
+            self.journal({'speaker': speaker, 'removed': True})
+
+    def sample_dir(self, speaker: str) -> str:
+        folder = f'{self.correctDir}/{speaker}' if speaker else self.correctDir
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def confirm(self, speaker: str, sample_name: str, duration: float, accuracy: float = None) -> None:
+        key = f'{speaker}/{sample_name}' if speaker else sample_name
+        self.journal({'speaker': speaker, 'sample': key, 'duration': round(duration, 3), 'accuracy': accuracy})
+
+    # queries
+
+    def speakers(self) -> list:
+        return [speaker for speaker in self.listed if speaker]
+
+    def sample_count(self, speaker: str) -> int:
+        return self.stats.get(speaker, {}).get('samples', 0)
+
+    def duration(self, speaker: str) -> float:
+        '''
+            Total duration of confirmed samples, sec
+        '''
+        return self.stats.get(speaker, {}).get('duration', 0.0)
+
+    def minutes(self, speaker: str) -> float:
+        return self.duration(speaker) / 60
+
+    def accuracy(self, speaker: str) -> float:
+        '''
+            Average alignment accuracy, None if no sample has one
+        '''
+        stats = self.stats.get(speaker)
+        if not stats or not stats['rated']:
+            return None
+        return stats['accuracy_sum'] / stats['rated']
+
+    def summary(self, speaker: str) -> str:
+        accuracy = self.accuracy(speaker)
+        text = f'{self.sample_count(speaker)} samples, {self.minutes(speaker):.1f} min'
+        return text if accuracy is None else f'{text}, {accuracy:.0f}% accuracy'
+
+    def rebuild(self, workers: int = 8) -> None:
+        '''
+            Indexes a correct/ tree confirmed before the registry existed;
+            WAV headers are read in parallel. Accuracy of such samples is unknown.
+            Samples saved as MP3 under a .wav name by older versions are probed
+            with ffprobe, the ones nothing can read are left out
+        '''
+        found = []
+        for root, _, files in os.walk(self.correctDir):
+            speaker = os.path.relpath(root, self.correctDir)
+            speaker = '' if speaker == '.' else speaker.replace(os.sep, '/')
+            for file in sorted(files):
+                name = file.rsplit('.', 1)[0]
+                key = f'{speaker}/{name}' if speaker else name
+                if file.endswith('.wav') and key not in self.samples:
+                    found.append((speaker, name, f'{root}/{file}'))
+
+        def wav_duration(path: str) -> float:
+            try:
+                with wave.open(path, 'rb') as w:
+                    return w.getnframes() / w.getframerate()
+            except (wave.Error, EOFError):
+                pass
+            try:
+                return float(mediainfo(path)['duration'])
+            except (OSError, KeyError, ValueError) as ex:
+                log(f'Skipping {path}: {ex!r}')
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            durations = list(executor.map(wav_duration, [path for _, _, path in found]))
+        for (speaker, name, _), duration in zip(found, durations):
+            if duration is not None:
+                self.confirm(speaker, name, duration)
@@ -0,0 +1,141 @@
+import argparse
+import itertools
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from audio_cache import AudioCache
+from segmentation import chunk_pauses, select_segments
+from silence import energy_envelope, nonsilent_ranges, chunk_ranges
+from utils import safe_audiosegment, log
+
+_envelope = None
+
+
+def load_envelope(folder: str, meta: dict) -> None:
+    global _envelope
+    _envelope = dict(meta, prefix=np.load(f'{folder}/prefix.npy', mmap_mode='r'),
+                     bounds=np.load(f'{folder}/bounds.npy', mmap_mode='r'))
+
+
+def evaluate(setting: tuple) -> dict:
+    '''
+        Chunk statistics of one (min_silence_len, silence_thresh, keep_silence)
+        setting the way split_audio_by_pauses would cut the book
+    '''
+    min_silence_len, silence_thresh, keep_silence = setting
+    env = _envelope
+    frame_rate, min_sec, max_sec = env['frame_rate'], env['min_sec'], env['max_sec']
+    prefix, bounds = env['prefix'], env['bounds']
+    length = len(prefix) - 1
+    nonsilent = nonsilent_ranges(prefix, bounds, env['channels'], env['max_amplitude'],
+                                 min_silence_len, silence_thresh, seek_step=min_sec)
+    ranges = chunk_ranges(nonsilent, keep_silence, length)
+    if env['segmentation'] == 'optimal':
+        ranges = ranges.tolist()
+        ranges = np.array(select_segments(ranges, chunk_pauses(ranges, keep_silence), min_sec*1000 + 1, max_sec*1000 - 1),
+                          dtype=np.int64).reshape(-1, 2)
+    # pydub pads a slice running past the last frame with silence
+    frames = bounds[ranges[:, 1]] - bounds[ranges[:, 0]]
+    durations = frames / frame_rate
+    accepted = (durations >= min_sec) & (durations <= max_sec)
+    # voiced ms of every chunk: the nonsilent ranges inside it, keep_silence padding not counted
+    voiced_prefix = np.concatenate([[0], np.cumsum(nonsilent[:, 1] - nonsilent[:, 0])])
+    first = np.searchsorted(nonsilent[:, 0], ranges[:, 0], 'left')
+    last = np.searchsorted(nonsilent[:, 1], ranges[:, 1], 'right')
+    voiced = (voiced_prefix[np.maximum(last, first)] - voiced_prefix[first]) / 1000
+    edges = list(range(0, max_sec + 2))
+    histogram, _ = np.histogram(np.minimum(durations, max_sec + 1), bins=edges + [np.inf])
+    return {'min_silence_len ms': min_silence_len, 'silence_threshold db': silence_thresh,
+            'keep_silence ms': keep_silence, 'chunks': len(ranges), 'accepted': int(accepted.sum()),
+            'shorter': int((durations < min_sec).sum()), 'longer': int((durations > max_sec).sum()),
+            'yield sec': float(durations[accepted].sum()),
+            'yield %': float(100 * durations[accepted].sum() / max(length / 1000, 1e-9)),
+            'voiced sec': float(voiced[accepted].sum()),
+            'histogram': {f'{edge}+' if edge > max_sec else f'{edge}': int(count)
+                          for edge, count in zip(edges, histogram)}}
+
+
+def sweep(audioPath: str, min_silence_lens: list, silence_threshs: list, keep_silences: list,
+          min_sec: int = 3, max_sec: int = 25, framerate: int = 22050, workers: int = None,
+          cache: AudioCache = None, segmentation: str = 'pauses') -> list:
+    '''
+        Decodes the book once and evaluates every combination in a process pool.
+        Workers share the energy envelope through a read-only memory-mapped file.
+        Results are sorted by the voiced audio of the accepted chunks, best
+        first: the yield includes keep_silence padding and would always favour
+        the largest keep_silence
+    '''
+    sound = safe_audiosegment(audioPath, framerate, cache)
+    if sound is None:
+        raise ValueError(f'Unsupported audio: {audioPath}')
+    log('Computing energy envelope...')
+    prefix, bounds = energy_envelope(sound)
+    settings = list(itertools.product(min_silence_lens, silence_threshs, keep_silences))
+    log(f'Evaluating {len(settings)} settings')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        np.save(f'{tmp}/prefix.npy', prefix)
+        np.save(f'{tmp}/bounds.npy', bounds)
+        meta = {'frame_rate': sound.frame_rate, 'channels': sound.channels,
+                'max_amplitude': sound.max_possible_amplitude, 'min_sec': min_sec, 'max_sec': max_sec,
+                'segmentation': segmentation}
+        del sound, prefix, bounds
+        # workers keep the files mapped, the pool is shut down before the folder is removed
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_envelope, initargs=(tmp, meta)) as executor:
+            results = list(executor.map(evaluate, settings))
+    return sorted(results, key=lambda result: (-result['voiced sec'], -result['accepted']))
+
+
+def int_list(text: str) -> list:
+    return [int(value) for value in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate split settings on a book without running the pipeline')
+    parser.add_argument('audio', help='book audio file')
+    parser.add_argument('--min-silence-len', type=int_list, default=[300, 500, 800, 1200],
+                        help='comma separated min_silence_len values, ms')
+    parser.add_argument('--silence-thresh', type=int_list, default=[-35, -40, -45, -50, -55],
+                        help='comma separated silence_threshold values, dB')
+    parser.add_argument('--keep-silence', type=int_list, default=[100, 300], help='comma separated keep_silence values, ms')
+    parser.add_argument('--params', default='params.json', help='min/max sample length and sampling rate are read from it')
+    parser.add_argument('--segmentation', choices=['pauses', 'optimal'], default=None,
+                        help='cut at every pause or merge chunks optimally, params.json value by default')
+    parser.add_argument('--workers', type=int, default=None, help='parallel evaluators')
+    parser.add_argument('--output', help='save the full report as JSON')
+    parser.add_argument('--write', action='store_true', help='store the best setting in --params')
+    args = parser.parse_args()
+
+    params = {}
+    if os.path.isfile(args.params):
+        with open(args.params, 'r') as params_json:
+            params = json.load(params_json)
+    min_sec, max_sec = params.get('min_sample_len sec', 3), params.get('max_sample_len sec', 25)
+    cache_mb = params.get('audio_cache_mb', 2048)
+    cache = AudioCache(params.get('audio_cache_dir', AudioCache.DIR), cache_mb) if cache_mb > 0 else None
+
+    results = sweep(args.audio, args.min_silence_len, args.silence_thresh, args.keep_silence, min_sec, max_sec,
+                    params.get('sampling_rate', 22050), args.workers, cache,
+                    args.segmentation or params.get('segmentation', 'pauses'))
+    print(f'{"silence ms":>10} {"thresh db":>9} {"keep ms":>7} {"chunks":>6} {"accepted":>8} '
+          f'{"short":>5} {"long":>5} {"yield %":>7} {"voiced sec":>10}')
+    for result in results:
+        print(f'{result["min_silence_len ms"]:>10} {result["silence_threshold db"]:>9} {result["keep_silence ms"]:>7} '
+              f'{result["chunks"]:>6} {result["accepted"]:>8} {result["shorter"]:>5} {result["longer"]:>5} '
+              f'{result["yield %"]:>7.1f} {result["voiced sec"]:>10.1f}')
+    if results:
+        print('Best setting chunk durations, sec: ' +
+              ' '.join(f'{edge}:{count}' for edge, count in results[0]['histogram'].items() if count))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+    if args.write and results:
+        for key in ['min_silence_len ms', 'silence_threshold db', 'keep_silence ms']:
+            params[key] = results[0][key]
+        with open(args.params, 'w') as params_json:
+            json.dump(params, params_json)
+        log(f'Best setting written to {args.params}')
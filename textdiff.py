@@ -0,0 +1,158 @@
+import re
+
+CUTOFF = 0.75  # difflib.Differ: less similar lines are shown without ? hints
+
+WORD = re.compile(r'\S+')
+
+
+def myers_opcodes(a: list, b: list) -> list:
+    '''
+        Shortest edit script of two sequences (Myers, O((N+M)D)) as
+        SequenceMatcher.get_opcodes() style (tag, i1, i2, j1, j2) tuples;
+        neighbouring deletes and inserts are merged into replace
+    '''
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    n, m = len(a) - prefix - suffix, len(b) - prefix - suffix
+
+    # trace[d][k + d]: furthest x on diagonal k = x - y after d edits
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        row = []
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[prefix + x] == b[prefix + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            row.append(x)
+            if x >= n and y >= m:
+                break
+        trace.append(row)
+        if x >= n and y >= m:
+            break
+
+    # walk back from (n, m): (kind, i, j) steps in a/b coordinates, reversed
+    steps = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        previous = trace[d - 1]
+        k = x - y
+        if k == -d or (k != d and previous[(k - 1 + d - 1) // 2] < previous[(k + 1 + d - 1) // 2]):
+            k_prev = k + 1
+        else:
+            k_prev = k - 1
+        x_prev = previous[(k_prev + d - 1) // 2]
+        # the edit leads from (x_prev, y_prev) to the start of the snake ending at (x, y)
+        snake_start = x_prev if k_prev > k else x_prev + 1
+        while x > snake_start:
+            x -= 1
+            y -= 1
+            steps.append(('equal', x, y))
+        if k_prev > k:
+            y -= 1
+            steps.append(('insert', x, y))
+        else:
+            x -= 1
+            steps.append(('delete', x, y))
+    while x > 0:
+        x -= 1
+        y -= 1
+        steps.append(('equal', x, y))
+
+    opcodes = []
+    i, j = 0, 0
+    if prefix:
+        opcodes.append(['equal', 0, prefix, 0, prefix])
+    for kind, x, y in reversed(steps):
+        x, y = x + prefix, y + prefix
+        di, dj = (1, 1) if kind == 'equal' else (1, 0) if kind == 'delete' else (0, 1)
+        last = opcodes[-1] if opcodes else None
+        if last is not None and last[2] == x and last[4] == y and \
+                (last[0] == kind or (kind != 'equal' and last[0] in ('delete', 'insert', 'replace'))):
+            if last[0] != kind:
+                last[0] = 'replace'
+            last[2] += di
+            last[4] += dj
+        else:
+            opcodes.append([kind, x, x + di, y, y + dj])
+    if suffix:
+        opcodes.append(['equal', len(a) - suffix, len(a), len(b) - suffix, len(b)])
+    return [tuple(opcode) for opcode in opcodes]
+
+
+MARKS = {'delete': ('-', ''), 'insert': ('', '+'), 'replace': ('^', '^')}
+
+
+def char_tags(a: str, b: str, atags: list, btags: list, a_start: int, b_start: int) -> None:
+    '''
+        Differ hint marks of a changed region: - deleted, + inserted, ^ replaced
+    '''
+    for tag, i1, i2, j1, j2 in myers_opcodes(a, b):
+        if tag != 'equal':
+            a_mark, b_mark = MARKS[tag]
+            atags[a_start + i1:a_start + i2] = a_mark * (i2 - i1)
+            btags[b_start + j1:b_start + j2] = b_mark * (j2 - j1)
+
+
+def pair_lines(a: str, b: str) -> list:
+    '''
+        Differ output for a replaced line a -> b: words are matched first and
+        characters are compared only inside the changed word runs
+    '''
+    a_words = [match.span() for match in WORD.finditer(a)]
+    b_words = [match.span() for match in WORD.finditer(b)]
+    atags, btags = [' '] * len(a), [' '] * len(b)
+    for tag, i1, i2, j1, j2 in myers_opcodes([a[s:e] for s, e in a_words], [b[s:e] for s, e in b_words]):
+        if tag == 'equal':
+            continue
+        if i2 == len(a_words) and j2 == len(b_words):
+            # a run at the line end takes the spaces after the previous matched word
+            a_start = a_words[i1 - 1][1] if i1 > 0 else 0
+            b_start = b_words[j1 - 1][1] if j1 > 0 else 0
+            a_end, b_end = len(a), len(b)
+        else:
+            # any other run takes the spaces before the next matched word
+            a_end, b_end = a_words[i2][0], b_words[j2][0]
+            a_start = a_words[i1][0] if i2 > i1 else a_end
+            b_start = b_words[j1][0] if j2 > j1 else b_end
+        char_tags(a[a_start:a_end], b[b_start:b_end], atags, btags, a_start, b_start)
+
+    matched = atags.count(' ')
+    if 2 * matched < CUTOFF * (len(a) + len(b)):
+        return [f'- {a}', f'+ {b}']
+    lines = [f'- {a}']
+    atags = ''.join(char if tag == ' ' and char in ' \t' else tag for char, tag in zip(a, atags)).rstrip()
+    if atags:
+        lines.append(f'? {atags}\n')
+    lines.append(f'+ {b}')
+    btags = ''.join(char if tag == ' ' and char in ' \t' else tag for char, tag in zip(b, btags)).rstrip()
+    if btags:
+        lines.append(f'? {btags}\n')
+    return lines
+
+
+def compare(a: list, b: list) -> list:
+    '''
+        difflib.Differ().compare(a, b) rendering of two lists of lines
+        ('  ', '- ', '+ ' and '? ' lines, the last ones end with a newline
+        as in Differ) without its quadratic matching
+    '''
+    lines = []
+    for tag, i1, i2, j1, j2 in myers_opcodes(a, b):
+        if tag == 'equal':
+            lines += [f'  {line}' for line in a[i1:i2]]
+        elif tag == 'replace' and i2 - i1 == 1 and j2 - j1 == 1:
+            lines += pair_lines(a[i1], b[j1])
+        else:
+            lines += [f'- {line}' for line in a[i1:i2]] + [f'+ {line}' for line in b[j1:j2]]
+    return lines
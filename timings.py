@@ -0,0 +1,74 @@
+import re
+
+from utils import read_text
+
+TIMING_EXTENSIONS = ['textgrid', 'srt', 'vtt']
+
+TEXTGRID_TOKEN = re.compile(r'"((?:[^"]|"")*)"|\[\d*\]|(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)|\S')
+CUE_TIME = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{1,2})[.,](\d{1,3})')
+MARKUP = re.compile(r'<[^>]*>|\{[^}]*\}')
+
+
+def is_path_to_timings(file: str) -> bool:
+    return file.rsplit('.', 1)[-1].lower() in TIMING_EXTENSIONS
+
+
+def parse_textgrid(text: str) -> list:
+    '''
+        (begin sec, end sec, text) of the non-empty intervals of the first
+        interval tier. Long and short Praat formats give the same stream of
+        strings and numbers once keys and [n] indexes are dropped
+    '''
+    tokens = []
+    for match in TEXTGRID_TOKEN.finditer(text):
+        if match.group(1) is not None:
+            tokens.append(match.group(1).replace('""', '"'))
+        elif match.group(2) is not None:
+            tokens.append(float(match.group(2)))
+    if len(tokens) < 5 or tokens[:2] != ['ooTextFile', 'TextGrid']:
+        raise ValueError('Not a TextGrid file')
+
+    pos, tiers = 5, int(tokens[4])
+    for _ in range(tiers):
+        kind, count = tokens[pos], int(tokens[pos + 4])
+        pos += 5
+        if kind == 'IntervalTier':
+            intervals = [tuple(tokens[i:i+3]) for i in range(pos, pos + 3*count, 3)]
+            return [(begin, end, label.strip()) for begin, end, label in intervals if label.strip()]
+        pos += 2*count  # TextTier: (time, mark) points
+    return []
+
+
+def cue_seconds(stamp: str) -> float:
+    hours, minutes, seconds, fraction = CUE_TIME.fullmatch(stamp.strip().split(' ')[0]).groups()
+    return int(hours or 0)*3600 + int(minutes)*60 + int(seconds) + int(fraction.ljust(3, '0')) / 1000
+
+
+def parse_subtitles(text: str) -> list:
+    '''
+        (begin sec, end sec, text) of SRT or WebVTT cues, markup removed
+    '''
+    cues = []
+    for block in re.split(r'\n\s*\n', text.replace('\r\n', '\n')):
+        lines = block.strip().split('\n')
+        for i, line in enumerate(lines):
+            if '-->' not in line:
+                continue
+            begin, end = line.split('-->', 1)
+            label = ' '.join(MARKUP.sub('', cue).strip() for cue in lines[i+1:]).strip()
+            if label:
+                cues.append((cue_seconds(begin), cue_seconds(end), label))
+            break
+    return cues
+
+
+def read_intervals(path: str) -> list:
+    '''
+        Timed texts of a TextGrid/SRT/VTT file sorted by begin
+    '''
+    text = read_text(path)
+    if path.lower().endswith('.textgrid'):
+        intervals = parse_textgrid(text)
+    else:
+        intervals = parse_subtitles(text)
+    return sorted(intervals)
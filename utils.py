@@ -1,22 +1,43 @@
 import argparse
+import hashlib
+import itertools
 import json
 import shutil
 import string
 import re
 import os
+import subprocess
+import threading
+import wave
+import numpy as np
 from collections import OrderedDict
 import speech_recognition
-from pydub.silence import split_on_silence
 from pydub import AudioSegment
+from pydub.audio_segment import fix_wav_headers
+from pydub.exceptions import CouldntDecodeError
 
+from chardet.universaldetector import UniversalDetector
 from nltk import word_tokenize, download
 from fuzzywuzzy import fuzz
-from difflib import Differ
 from datetime import datetime
 from pprint import pprint
+from profiling import profiler
+from normalize import chunk_leveler, apply_levels
+from resample import resample_segment
+from segmentation import chunk_pauses, select_segments
+from silence import iter_chunk_ranges
+from urllib.error import HTTPError
+from recognition import TransientRecognitionError, PermanentRecognitionError, transient_status
+from textdiff import compare
 
 download('punkt')
 
+ENCODING_SAMPLE_BYTES = 64 * 1024
+# next to the code, not in whatever directory the app was started from
+ENCODINGS_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'encodings.json')
+encodings_lock = threading.Lock()
+AUDIO_FORMATS = {'mp3': 'mp3', 'wav': 'wav', 'ogg': 'ogg', 'flac': 'flac', '3gp': '3gp', '3g': '3gp'}
+
 def log(message):
     pprint(f'log {datetime.now()}; msg: {message}')
 
@@ -28,82 +49,327 @@ def is_path_to_txt(file: str) ->bool:
     extension = file.rsplit('.', 1)[-1]
     return extension in ['txt', 'lab']
 
-def safe_audiosegment(audioPath: str, framerate: int = 22050) -> AudioSegment:
-    if audioPath.lower().endswith('.mp3'):
-        sound = AudioSegment.from_mp3(audioPath)
-    elif audioPath.lower().endswith('.wav'):
-        sound = AudioSegment.from_wav(audioPath)
-    elif audioPath.lower().endswith('.ogg'):
-        sound = AudioSegment.from_ogg(audioPath)
-    elif audioPath.lower().endswith('.flac'):
-        sound = AudioSegment.from_file(audioPath, "flac")
-    elif audioPath.lower().endswith('.3gp'):
-        sound = AudioSegment.from_file(audioPath, "3gp")
-    elif audioPath.lower().endswith('.3g'):
-        sound = AudioSegment.from_file(audioPath, "3gp")
-    else:
+def safe_audiosegment(audioPath: str, framerate: int = 22050, cache=None, source_hash: str = None,
+                      begin: float = 0, end: float = -1) -> AudioSegment:
+    '''
+        With an AudioCache the decoded (and resampled) PCM is reused across runs;
+        source_hash is file_hash(audioPath), computed if not given.
+        begin/end (sec, end < 0 - till the end) limit decoding to that range;
+        a cached source is sliced instead, ranges themselves are not cached
+    '''
+    ranged = begin > 0 or end >= 0
+    if cache is not None:
+        key = cache.key(source_hash or file_hash(audioPath), framerate)
+        sound = cache.load(key)
+        if sound is not None:
+            profiler.count('audio cache hits')
+            if ranged:
+                return sound[int(begin*1000):int(end*1000)] if end >= 0 else sound[int(begin*1000):]
+            return sound
+        profiler.count('audio cache misses')
+    sound = decode_audio(audioPath, framerate, begin, end)
+    if cache is not None and sound is not None and not ranged:
+        with profiler.span('audio cache store'):
+            cache.store(key, sound)
+    return sound
+
+def decode_audio(audioPath: str, framerate: int = 22050, begin: float = 0, end: float = -1) -> AudioSegment:
+    extension = audioPath.rsplit('.', 1)[-1].lower()
+    if extension not in AUDIO_FORMATS:
         return None
-    if framerate < 0:
+    with profiler.span('decode'):
+        if begin <= 0 and end < 0:
+            sound = AudioSegment.from_file(audioPath, AUDIO_FORMATS[extension])
+        elif extension == 'wav':
+            sound = read_wav_range(audioPath, begin, end)
+        else:
+            sound = ffmpeg_range(audioPath, begin, end)
+    profiler.count('decoded bytes', len(sound.raw_data))
+    if framerate < 0 or sound.frame_rate == framerate:
         return sound
-    return sound.set_frame_rate(framerate)
+    with profiler.span('resample'):
+        return resample_segment(sound, framerate)
+
+def read_wav_range(audioPath: str, begin: float, end: float) -> AudioSegment:
+    '''
+        Seeks to begin and reads only the frames up to end (sec, < 0 - till the end)
+    '''
+    try:
+        with wave.open(audioPath, 'rb') as w:
+            rate, channels, width, frames = w.getframerate(), w.getnchannels(), w.getsampwidth(), w.getnframes()
+            first = min(int(max(begin, 0) * rate), frames)
+            count = frames - first if end < 0 else max(min(int(end * rate), frames) - first, 0)
+            w.setpos(first)
+            data = w.readframes(count)
+    except wave.Error:
+        # not plain PCM, let pydub decode it all
+        duration = end - begin if end >= 0 else None
+        return AudioSegment.from_file(audioPath, 'wav', start_second=begin, duration=duration)
+    if width == 1:
+        # WAV stores 8 bit samples unsigned
+        data = (np.frombuffer(data, dtype=np.uint8).astype(np.int16) - 128).astype(np.int8).tobytes()
+    return AudioSegment(data=data, sample_width=width, frame_rate=rate, channels=channels)
+
+def ffmpeg_range(audioPath: str, begin: float, end: float) -> AudioSegment:
+    '''
+        -ss before -i makes ffmpeg seek in the container instead of decoding
+        and dropping everything before begin
+    '''
+    command = [AudioSegment.converter, '-nostdin', '-y', '-ss', str(max(begin, 0)), '-i', audioPath]
+    if end >= 0:
+        command += ['-t', str(max(end - max(begin, 0), 0))]
+    command += ['-vn', '-acodec', 'pcm_s16le', '-f', 'wav', '-']
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0 or len(process.stdout) == 0:
+        raise CouldntDecodeError(f'Decoding failed. ffmpeg returned error code: {process.returncode}\n\n'
+                                 f'{process.stderr.decode(errors="ignore")}')
+    data = bytearray(process.stdout)
+    fix_wav_headers(data)
+    return AudioSegment(bytes(data))
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_encodings() -> dict:
+    '''
+        The encodings cache, empty if it is missing or unreadable
+    '''
+    try:
+        with open(ENCODINGS_CACHE, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def read_text(path: str) -> str:
+    '''
+        Reads the file once: strict UTF-8 first, otherwise chardet on the first
+        ENCODING_SAMPLE_BYTES; detected encodings are cached by content hash
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        pass
+
+    digest = hashlib.sha1(data).hexdigest()
+    with encodings_lock:
+        cache = read_encodings()
+        encoding = cache.get(digest)
+        if encoding is None:
+            profiler.count('encoding cache misses')
+            detector = UniversalDetector()
+            detector.feed(data[:ENCODING_SAMPLE_BYTES])
+            detector.close()
+            encoding = detector.result['encoding'] or 'cp1251'
+            cache[digest] = encoding
+            # the lock covers threads, the per-process part file concurrent processes
+            part = f'{ENCODINGS_CACHE}.{os.getpid()}.part'
+            try:
+                with open(part, 'w') as f:
+                    json.dump(cache, f)
+                os.replace(part, ENCODINGS_CACHE)
+            except OSError as ex:
+                log(f'Encoding cache not saved: {ex}')
+        else:
+            profiler.count('encoding cache hits')
+    return data.decode(encoding, errors='replace')
+
+def detect_chunks(sound: AudioSegment, min_silence_len: int = 800, silence_thresh: int = -50,
+                  keep_silence: int = 400, seek_step: int = 1) -> list:
+    '''
+        Same ranges (ms) as pydub split_on_silence, without cutting the audio
+    '''
+    return list(iter_chunk_ranges(sound, min_silence_len, silence_thresh, keep_silence, seek_step))
+
+def iter_chunks(sound: AudioSegment, ranges, first: int = 0, levels=None):
+    '''
+        Yields (index, chunk) for ranges (ms, a list or a generator) from first
+        on. A chunk is cut, and trimmed/leveled by levels (normalize.chunk_leveler)
+        if given, only when the consumer asks for the next one, so besides
+        the source only the current chunk is held
+    '''
+    for i, chunk_range in enumerate(ranges):
+        if i < first:
+            continue
+        dc = gain = None
+        if levels is not None:
+            chunk_range, dc, gain = levels(chunk_range)
+        chunk = sound[chunk_range[0]:chunk_range[1]]
+        if gain is not None:
+            chunk = apply_levels(chunk, dc, gain)
+        yield i, chunk
+
+def export_chunk(chunk: AudioSegment, out_file: str, store=None) -> None:
+    '''
+        Atomic WAV export, or append to a ChunkStore under the file name
+    '''
+    with profiler.span('export'):
+        if store is not None:
+            store.append(os.path.basename(out_file), chunk)
+        else:
+            chunk.export(f'{out_file}.part', format="wav")
+            os.replace(f'{out_file}.part', out_file)
+    profiler.count('exported chunks')
+    profiler.count('exported bytes', len(chunk.raw_data))
+
+def iter_detected(ranges, first: int = 0, tracker=None, checkpoint=None):
+    '''
+        Passes streamed chunk ranges through, journaling the ones the
+        checkpoint does not have yet and counting them in the split progress.
+        Detection runs while the next range is asked for, that time goes to
+        the 'silence detection' span
+    '''
+    journaled = len(checkpoint.chunks or []) if checkpoint is not None else 0
+    ranges = iter(ranges)
+    for i in itertools.count():
+        with profiler.span('silence detection'):
+            chunk_range = next(ranges, None)
+        if chunk_range is None:
+            return
+        if checkpoint is not None and i >= journaled:
+            checkpoint.add_chunk(chunk_range)
+        if tracker is not None:
+            tracker.grow('split')
+            if i < first:
+                tracker.advance('split')
+        yield chunk_range
 
 def split_audio_by_pauses(filename: str, outdir: str, min_sec: int = 3, max_sec: int = 25,
                           min_silence_len: int = 800, silence_thresh: int = -50,
-                          keep_silence: int = 400, framerate: int = 22050, begin: int = -1, end: int = -1) -> None:
-
+                          keep_silence: int = 400, framerate: int = 22050, begin: float = -1, end: float = -1,
+                          tracker=None, cancelled=None, checkpoint=None, on_chunk=None, store=None,
+                          normalize: str = None, target_dbfs: float = -1.0, trim_margin: int = -1,
+                          cache=None, source_hash: str = None, segmentation: str = 'pauses') -> None:
+    '''
+        tracker gets 'decode' and per-chunk 'split' progress; export stops
+        once cancelled() is true, chunks are written atomically.
+        With a checkpoint, detected ranges and handled chunks are journaled
+        and an interrupted split resumes at the first unhandled chunk.
+        on_chunk(path) is called after every exported chunk.
+        With a ChunkStore chunks are appended to it instead of separate WAV files.
+        normalize ('peak' or 'rms') brings every chunk to target_dbfs and removes DC;
+        trim_margin >= 0 trims edge silence down to that many ms.
+        cache (AudioCache) skips decoding of a source that was already split.
+        segmentation='optimal' merges neighbouring chunks into min_sec..max_sec
+        samples instead of dropping the ones out of the limits
+    '''
+    first = 0
+    if checkpoint is not None and checkpoint.chunks is not None:
+        first = checkpoint.resume_index()
+        if checkpoint.chunks_complete and first >= len(checkpoint.chunks):
+            return
+
+    if tracker is not None:
+        tracker.start('decode', 1)
     log('Uploading audio...')
-    sound_file = safe_audiosegment(filename, framerate)
+    begin = max(begin, 0)
+    end = end if end > 0 else -1
+    if end >= 0 and begin > end:
+        begin, end = end, begin
+    # only the selected range is decoded
+    sound_file = safe_audiosegment(filename, framerate, cache, source_hash, begin, end)
     if sound_file is None:
         return
     log('Audio uploaded!')
-
-    duration = sound_file.duration_seconds
-    begin = max(begin, 0) if begin > 0 else 0
-    end = end if end > 0 else duration
-
-    if begin > end:
-        begin, end = end, begin
-
-    begin = max(begin, 0)
-    end = min(end, duration)
-    sound_file = sound_file[int(begin*1000):int(end*1000)]
-
-    audio_chunks = split_on_silence(sound_file, min_silence_len, silence_thresh=silence_thresh, keep_silence=keep_silence, seek_step=min_sec)
-    log(f'Samples from file = {len(audio_chunks)}')
+    if tracker is not None:
+        tracker.finish('decode')
+
+    if checkpoint is not None and checkpoint.chunks_complete:
+        ranges = checkpoint.chunks
+        log(f'Resuming split from sample {first+1}')
+    elif segmentation == 'optimal':
+        # the cut points depend on all pauses, so detection has to finish first
+        with profiler.span('silence detection'):
+            ranges = detect_chunks(sound_file, min_silence_len, silence_thresh, keep_silence, seek_step=min_sec)
+            # 1 ms margins keep frame rounding of the chunks inside the limits
+            ranges = select_segments(ranges, chunk_pauses(ranges, keep_silence), min_sec*1000 + 1, max_sec*1000 - 1)
+        if checkpoint is not None:
+            checkpoint.set_chunks(ranges)
+    else:
+        # chunks are exported while the rest of the book is scanned
+        ranges = iter_detected(iter_chunk_ranges(sound_file, min_silence_len, silence_thresh, keep_silence,
+                                                 seek_step=min_sec), first, tracker, checkpoint)
+    if tracker is not None:
+        tracker.start('split', len(ranges) if isinstance(ranges, list) else 0)
+        if isinstance(ranges, list):
+            tracker.advance('split', first)
+    with profiler.span('levels'):
+        levels = chunk_leveler(sound_file, silence_thresh, trim_margin, normalize, target_dbfs)
     count, lt, gt = 0, 0, 0
-    for i, chunk in enumerate(audio_chunks):
+    basename = os.path.basename(filename.rsplit('.', 1)[0])
+    total = len(ranges) if isinstance(ranges, list) else 0
+    for i, chunk in iter_chunks(sound_file, ranges, first, levels):
+        total = max(total, i + 1)
+        if cancelled is not None and cancelled():
+            break
+        out_file = None
         if max_sec >= chunk.duration_seconds >= min_sec:
             count += 1
-            filename = filename.rsplit('.', 1)[0]
-            out_file = f"{outdir}/{os.path.basename(filename)}_{str(i+1).zfill(5)}.wav"
-            chunk.export(out_file, format="wav")
+            out_file = f"{outdir}/{basename}_{str(i+1).zfill(5)}.wav"
+            export_chunk(chunk, out_file, store)
         elif max_sec < chunk.duration_seconds:
             gt += 1
         elif min_sec > chunk.duration_seconds:
             lt += 1
+        if checkpoint is not None:
+            checkpoint.set_split(i, out_file and os.path.basename(out_file))
+        if on_chunk is not None and out_file is not None:
+            on_chunk(out_file)
+        if tracker is not None:
+            tracker.advance('split')
+    else:
+        if checkpoint is not None and not checkpoint.chunks_complete:
+            checkpoint.set_stage('detect')
+        if tracker is not None:
+            tracker.finish('split')
+    profiler.count('chunks', total)
+    log(f'Samples from file = {total}')
     log(f'Samples less than {min_sec} sec = {lt}')
     log(f'Samples more than {max_sec} sec = {gt}')
     log(f'Acceptable samples count = {count}')
 
-def speech_recognize(filename: str, language: str = 'ru-RU') -> str:
+def speech_recognize(filename, language: str = 'ru-RU') -> str:
     '''
-        Only WAV/FLAC audio file
+        Only WAV/FLAC audio file or speech_recognition.AudioData.
+        Returns '' if there is no speech, raises TransientRecognitionError
+        if the service could not be reached or answered 429/5xx and
+        PermanentRecognitionError if it rejected the request; the audio is never removed
     '''
     recognizer = speech_recognition.Recognizer()
-    sample_audio = speech_recognition.AudioFile(filename)
-    with sample_audio as audio_file:
-        audio_content = recognizer.record(audio_file)
+    if isinstance(filename, speech_recognition.AudioData):
+        audio_content = filename
+    else:
+        sample_audio = speech_recognition.AudioFile(filename)
+        with profiler.span('read chunk'), sample_audio as audio_file:
+            audio_content = recognizer.record(audio_file)
     try:
-        result = recognizer.recognize_google(audio_content, language=language)
-    except Exception as ex:
-        os.remove(filename)
+        with profiler.span('recognition'):
+            result = recognizer.recognize_google(audio_content, language=language)
+    except speech_recognition.UnknownValueError:
+        profiler.count('no speech')
         return ''
+    except (speech_recognition.RequestError, OSError) as ex:
+        # recognize_google raises RequestError while handling the urllib error
+        cause = ex if isinstance(ex, HTTPError) else ex.__context__
+        if isinstance(cause, HTTPError) and not transient_status(cause.code):
+            raise PermanentRecognitionError(f'{ex!r}') from ex
+        raise TransientRecognitionError(f'{ex!r}') from ex
     return result
 
-def text_difference(original: str, recognized: str) -> str:
-    d = Differ()
+@profiler.timed('diff')
+def text_difference(original: str, recognized: str) -> list:
+    '''
+        Differ style lines of the recognized text against the original words,
+        see textdiff.compare
+    '''
     res = re.findall(r'\w+', original)
-    diff = d.compare(recognized.lower().splitlines(), ' '.join(res).lower().splitlines())
+    diff = compare(recognized.lower().splitlines(), ' '.join(res).lower().splitlines())
     return '\n'.join(diff).splitlines()
 
 class StringComparison:
@@ -111,7 +377,8 @@ class StringComparison:
         self.__words = []
         self.__indexes = []
 
-        self.__origin_tokens = word_tokenize(text)
+        with profiler.span('tokenization'):
+            self.__origin_tokens = word_tokenize(text)
         self.__words_idx = [idx for idx, word in enumerate(self.__origin_tokens) if word.isalpha() or word.isdigit()]
         self.__max_idx = len(self.__words_idx)
 
@@ -168,6 +435,7 @@ class StringComparison:
                 func2()
                 break
 
+    @profiler.timed('StringComparison.find')
     def find(self, asr: str) -> (int, int, str):
         self.__words.clear()
         self.__indexes.clear()
@@ -0,0 +1,313 @@
+import os
+import zipfile
+import numpy as np
+
+from PyQt5 import QtWidgets, QtCore, QtGui
+from utils import safe_audiosegment, log
+
+PEAKS_BASE_BIN = 32
+PEAKS_MIN_BINS = 256
+
+
+class PeakPyramid:
+    '''
+        Min/max peaks of a sample at several resolutions.
+        Level 0 holds one (min, max) pair per PEAKS_BASE_BIN frames,
+        every next level halves the resolution of the previous one.
+    '''
+    def __init__(self, frame_rate: int, frames: int, mins: list, maxs: list):
+        self.frame_rate = frame_rate
+        self.frames = frames
+        self.mins = mins
+        self.maxs = maxs
+
+    @property
+    def duration_ms(self) -> int:
+        return int(self.frames * 1000 / self.frame_rate) if self.frame_rate else 0
+
+    @classmethod
+    def from_file(cls, audioPath: str) -> 'PeakPyramid':
+        sound = safe_audiosegment(audioPath, -1)
+        if sound is None:
+            return None
+        samples = np.array(sound.get_array_of_samples()).reshape(-1, sound.channels)
+        return cls.from_samples(samples, sound.frame_rate, sound.sample_width)
+
+    @classmethod
+    def from_samples(cls, samples: np.ndarray, frame_rate: int, sample_width: int) -> 'PeakPyramid':
+        '''
+            samples: frames x channels integer PCM
+        '''
+        frames, channels = samples.shape
+        bins = -(-frames // PEAKS_BASE_BIN)
+        padded = np.zeros((bins*PEAKS_BASE_BIN, channels), dtype=np.float32)
+        padded[:frames] = samples
+        padded /= float(1 << (8*sample_width - 1))
+        padded = padded.reshape(bins, -1)
+        mins, maxs = [padded.min(axis=1)], [padded.max(axis=1)]
+
+        while len(mins[-1]) > PEAKS_MIN_BINS:
+            lo, hi = mins[-1], maxs[-1]
+            if len(lo) % 2:
+                lo, hi = np.append(lo, lo[-1]), np.append(hi, hi[-1])
+            mins.append(lo.reshape(-1, 2).min(axis=1))
+            maxs.append(hi.reshape(-1, 2).max(axis=1))
+        return cls(frame_rate, frames, mins, maxs)
+
+    @classmethod
+    def load(cls, cachePath: str, stamp: tuple) -> 'PeakPyramid':
+        '''
+            stamp identifies the sample version, see sample_stamp
+        '''
+        if not os.path.isfile(cachePath):
+            return None
+        with np.load(cachePath) as data:
+            if (int(data['size']), int(data['mtime'])) != stamp:
+                return None
+            levels = int(data['levels'])
+            return cls(int(data['frame_rate']), int(data['frames']),
+                       [data[f'min{i}'] for i in range(levels)],
+                       [data[f'max{i}'] for i in range(levels)])
+
+    def save(self, cachePath: str, stamp: tuple) -> None:
+        arrays = {f'min{i}': level for i, level in enumerate(self.mins)}
+        arrays.update({f'max{i}': level for i, level in enumerate(self.maxs)})
+        tmp = f'{cachePath}.tmp.npz'
+        np.savez(tmp, frame_rate=self.frame_rate, frames=self.frames, levels=len(self.mins),
+                 size=stamp[0], mtime=stamp[1], **arrays)
+        os.replace(tmp, cachePath)
+
+    def columns(self, begin: int, end: int, width: int) -> (np.ndarray, np.ndarray):
+        '''
+            Min/max per pixel column for frames [begin, end)
+        '''
+        frames_per_px = max((end - begin) / max(width, 1), 1)
+        level = 0
+        while level + 1 < len(self.mins) and PEAKS_BASE_BIN << (level + 1) <= frames_per_px:
+            level += 1
+        bin_size = PEAKS_BASE_BIN << level
+        lo, hi = self.mins[level], self.maxs[level]
+
+        edges = np.linspace(begin, end, width + 1) // bin_size
+        edges = np.clip(edges.astype(np.int64), 0, len(lo) - 1)
+        # the extra last offset bounds the final column; its own result is dropped
+        col_min = np.minimum.reduceat(lo, edges)[:-1]
+        col_max = np.maximum.reduceat(hi, edges)[:-1]
+        # columns narrower than a bin (non-increasing offsets) already hold lo[start]/hi[start]
+        return col_min, col_max
+
+
+def peaks_cache_path(cacheDir: str, audioPath: str) -> str:
+    sample_name = os.path.basename(audioPath).rsplit('.', 1)[0]
+    return f'{cacheDir}/{sample_name}.npz'
+
+
+def sample_stamp(audioPath: str, store=None) -> tuple:
+    '''
+        (size, mtime) of a WAV file or (bytes, offset) of a ChunkStore chunk
+    '''
+    name = os.path.basename(audioPath)
+    if store is not None and name in store and not os.path.isfile(audioPath):
+        entry = store.index[name]
+        return entry['bytes'], entry['offset']
+    stat = os.stat(audioPath)
+    return stat.st_size, int(stat.st_mtime)
+
+
+class PeaksThread(QtCore.QThread):
+    peaks_signal = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        QtCore.QThread.__init__(self, parent)
+
+        self.audioPath:str
+        self.cacheDir:str
+        self.store = None
+
+    def run(self):
+        # an exception escaping run() aborts the application
+        try:
+            pyramid = self.peaks(self.audioPath, self.cacheDir, self.store)
+        except Exception as ex:
+            log(f'No waveform for {self.audioPath}: {ex!r}')
+            pyramid = None
+        self.peaks_signal.emit(self.audioPath, pyramid)
+
+    @staticmethod
+    def peaks(audioPath: str, cacheDir: str, store=None) -> PeakPyramid:
+        name = os.path.basename(audioPath)
+        cachePath = peaks_cache_path(cacheDir, audioPath)
+        stamp = sample_stamp(audioPath, store)
+        try:
+            pyramid = PeakPyramid.load(cachePath, stamp)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # a corrupt cache is rebuilt
+            pyramid = None
+        if pyramid is None:
+            if store is not None and name in store and not os.path.isfile(audioPath):
+                pyramid = PeakPyramid.from_samples(store.samples(name), store.index[name]['sample_rate'],
+                                                   store.index[name]['sample_width'])
+            else:
+                pyramid = PeakPyramid.from_file(audioPath)
+            if pyramid is not None:
+                os.makedirs(cacheDir, exist_ok=True)
+                pyramid.save(cachePath, stamp)
+        return pyramid
+
+
+class WaveformWidget(QtWidgets.QWidget):
+    '''
+        Waveform of the current sample with draggable trim handles.
+        Trim is reported the same way as beginTimeEdit/endTimeEdit:
+        ms cut from the beginning and ms cut from the end.
+    '''
+    trim_signal = QtCore.pyqtSignal(int, int)
+    seek_signal = QtCore.pyqtSignal(int)
+
+    HANDLE_GRAB_PX = 6
+
+    def __init__(self, parent=None):
+        super(WaveformWidget, self).__init__(parent)
+        self.setMinimumHeight(90)
+        self.setMouseTracking(True)
+
+        self.audioPath = None
+        self.pyramid = None
+        self.leftEdge = 0
+        self.rightEdge = 0
+        self.position = 0
+        self.viewBegin = 0
+        self.viewEnd = 0
+        self.dragging = None
+
+        self.thread = PeaksThread(self)
+        self.thread.peaks_signal.connect(self.peaksLoaded)
+        # the thread is still running when peaks_signal arrives, start() would be a no-op there
+        self.thread.finished.connect(self.startPending)
+        self.pending = None
+
+    def load(self, audioPath: str, cacheDir: str, store=None) -> None:
+        self.audioPath = audioPath
+        self.pyramid = None
+        self.leftEdge, self.rightEdge, self.position = 0, 0, 0
+        self.update()
+        if self.thread.isRunning():
+            self.pending = (audioPath, cacheDir, store)
+            return
+        self.thread.audioPath = audioPath
+        self.thread.cacheDir = cacheDir
+        self.thread.store = store
+        self.thread.start()
+
+    def clear(self) -> None:
+        self.audioPath = None
+        self.pyramid = None
+        self.update()
+
+    def startPending(self):
+        if self.pending is None:
+            return
+        path, cacheDir, store = self.pending
+        self.pending = None
+        self.thread.audioPath = path
+        self.thread.cacheDir = cacheDir
+        self.thread.store = store
+        self.thread.start()
+
+    def peaksLoaded(self, audioPath, pyramid):
+        if audioPath != self.audioPath:
+            return
+        self.pyramid = pyramid
+        if pyramid is not None:
+            self.viewBegin, self.viewEnd = 0, pyramid.frames
+        self.update()
+
+    def setTrim(self, leftEdge: int, rightEdge: int) -> None:
+        if (leftEdge, rightEdge) != (self.leftEdge, self.rightEdge):
+            self.leftEdge, self.rightEdge = leftEdge, rightEdge
+            self.update()
+
+    def setPosition(self, position: int) -> None:
+        if position != self.position:
+            self.position = position
+            self.update()
+
+    # coordinates
+
+    def msToX(self, ms: int) -> float:
+        frame = ms * self.pyramid.frame_rate / 1000
+        return (frame - self.viewBegin) * self.width() / max(self.viewEnd - self.viewBegin, 1)
+
+    def xToMs(self, x: float) -> int:
+        frame = self.viewBegin + x * (self.viewEnd - self.viewBegin) / max(self.width(), 1)
+        return int(min(max(frame, 0), self.pyramid.frames) * 1000 / self.pyramid.frame_rate)
+
+    # events
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtGui.QColor(255, 255, 255))
+        if self.pyramid is None or self.width() < 2:
+            return
+        width, mid = self.width(), self.height() / 2
+        col_min, col_max = self.pyramid.columns(self.viewBegin, self.viewEnd, width)
+
+        painter.setPen(QtGui.QColor(0, 0, 255))
+        lines = [QtCore.QLineF(x, mid - hi*mid, x, mid - lo*mid) for x, (lo, hi) in enumerate(zip(col_min, col_max))]
+        painter.drawLines(lines)
+
+        shade = QtGui.QColor(128, 128, 128, 120)
+        left_x = self.msToX(self.leftEdge)
+        right_x = self.msToX(self.pyramid.duration_ms - self.rightEdge)
+        painter.fillRect(QtCore.QRectF(0, 0, max(left_x, 0), self.height()), shade)
+        painter.fillRect(QtCore.QRectF(right_x, 0, max(width - right_x, 0), self.height()), shade)
+
+        painter.setPen(QtGui.QPen(QtGui.QColor(255, 165, 0), 2))
+        painter.drawLine(QtCore.QLineF(left_x, 0, left_x, self.height()))
+        painter.drawLine(QtCore.QLineF(right_x, 0, right_x, self.height()))
+
+        painter.setPen(QtGui.QColor(255, 0, 0))
+        pos_x = self.msToX(self.position)
+        painter.drawLine(QtCore.QLineF(pos_x, 0, pos_x, self.height()))
+
+    def mousePressEvent(self, event):
+        if self.pyramid is None:
+            return
+        x = event.pos().x()
+        if abs(x - self.msToX(self.leftEdge)) <= self.HANDLE_GRAB_PX:
+            self.dragging = 'left'
+        elif abs(x - self.msToX(self.pyramid.duration_ms - self.rightEdge)) <= self.HANDLE_GRAB_PX:
+            self.dragging = 'right'
+        else:
+            self.seek_signal.emit(self.xToMs(x))
+
+    def mouseMoveEvent(self, event):
+        if self.pyramid is None:
+            return
+        x = event.pos().x()
+        if self.dragging is None:
+            near = min(abs(x - self.msToX(self.leftEdge)),
+                       abs(x - self.msToX(self.pyramid.duration_ms - self.rightEdge)))
+            self.setCursor(QtCore.Qt.SizeHorCursor if near <= self.HANDLE_GRAB_PX else QtCore.Qt.ArrowCursor)
+            return
+        ms = self.xToMs(x)
+        duration = self.pyramid.duration_ms
+        if self.dragging == 'left':
+            self.leftEdge = min(ms, duration - self.rightEdge)
+        else:
+            self.rightEdge = min(duration - ms, duration - self.leftEdge)
+        self.update()
+        self.trim_signal.emit(self.leftEdge, self.rightEdge)
+
+    def mouseReleaseEvent(self, event):
+        self.dragging = None
+
+    def wheelEvent(self, event):
+        if self.pyramid is None:
+            return
+        factor = 0.8 if event.angleDelta().y() > 0 else 1.25
+        anchor = self.viewBegin + event.pos().x() * (self.viewEnd - self.viewBegin) / max(self.width(), 1)
+        span = min(max((self.viewEnd - self.viewBegin) * factor, self.width()), self.pyramid.frames)
+        begin = min(max(anchor - (anchor - self.viewBegin) * factor, 0), self.pyramid.frames - span)
+        self.viewBegin, self.viewEnd = int(begin), int(begin + span)
+        self.update()